@@ -21,7 +21,6 @@ from ansible.plugins.action import ActionBase
 from ansible.release import __version__ as ansible_version
 
 from dciauth.version import __version__ as dciauth_version
-from dciclient.v1.api import context as dci_context
 from dciclient.version import __version__ as dciclient_version
 
 import os
@@ -42,6 +41,15 @@ if sys.version_info >= (3, 0):
 if sys.version_info < (3, 0) and sys.version_info >= (2, 5):
     from urlparse import urlparse  # noqa
 
+# Ansible loads the action plugins by path: make the module_utils
+# directory next to this one importable to share code with the modules.
+_BASE_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+if _BASE_DIR not in sys.path:
+    sys.path.append(_BASE_DIR)
+
+from module_utils.dci_session import get_context  # noqa: E402
+from requests.exceptions import ConnectionError  # noqa: E402
+
 
 class ActionModule(ActionBase):
 
@@ -63,12 +71,8 @@ class ActionModule(ActionBase):
         login, password, url, client_id, api_secret = self._get_details()
         user_agent = ('Ansible/%s (python-dciclient/%s, python-dciauth/%s)'
                       ) % (ansible_version, dciclient_version, dciauth_version)
-        if login is not None and password is not None:
-            return dci_context.build_dci_context(url, login, password,
-                                                 user_agent)
-        elif client_id is not None and api_secret is not None:
-            return dci_context.build_signature_context(url, client_id,
-                                                       api_secret, user_agent)
+        return get_context(url, login, password, client_id, api_secret,
+                           user_agent)
 
     def _git_to_reproduce(self, repo_name, components):
         for git_component in components:
@@ -136,25 +140,31 @@ class ActionModule(ActionBase):
         except ansible_errors.AnsibleError:
             pass
 
-        cmpt, _ = dci_component.get_or_create(
-            ctx,
-            display_name="%s %s" % (_project_name, cmpt_version),
-            version=cmpt_version,
-            uid=_commit_id,
-            team_id=team_id,
-            topic_id=topic_id,
-            type=_project_name,
-            defaults={
-                "url": cmpt_url})
+        try:
+            cmpt, _ = dci_component.get_or_create(
+                ctx,
+                display_name="%s %s" % (_project_name, cmpt_version),
+                version=cmpt_version,
+                uid=_commit_id,
+                team_id=team_id,
+                topic_id=topic_id,
+                type=_project_name,
+                defaults={
+                    "url": cmpt_url})
+        except ConnectionError as exc:
+            raise ansible_errors.AnsibleError('error while getting or creating component %s: %s' % (cmpt_name, exc))  # noqa
 
         if not cmpt.ok:
             raise ansible_errors.AnsibleError('error while getting or creating component %s: %s' % (cmpt_name, cmpt.text))  # noqa
         cmpt_id = cmpt.json()['component']['id']
 
-        ret = dci_job.add_component(
-            ctx,
-            job_id=job_id,
-            component_id=cmpt_id)
+        try:
+            ret = dci_job.add_component(
+                ctx,
+                job_id=job_id,
+                component_id=cmpt_id)
+        except ConnectionError as exc:
+            raise ansible_errors.AnsibleError('error while attaching component %s to job %s: %s' % (cmpt_id, job_id, exc))  # noqa
         if ret.status_code == 409:
             module_return['message_action_plugin_git'] = ret.text
         elif ret.status_code != 201:
@@ -2,18 +2,43 @@
 from __future__ import (absolute_import, division, print_function)
 __metaclass__ = type
 
+import contextlib
+import hashlib
+import io
+import json
 import os
+import queue
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor
 
 from ansible import constants as C
 from ansible.plugins.callback.default import CallbackModule as CM_default
 from ansible.release import __version__ as ansible_version
 
 from dciauth.version import __version__ as dciauth_version
-from dciclient.v1.api import context as dci_context
 from dciclient.v1.api import file as dci_file
 from dciclient.v1.api import jobstate as dci_jobstate
 from dciclient.version import __version__ as dciclient_version
 
+# Ansible loads the callback plugins by path: make the module_utils
+# directory next to this one importable to share code with the modules.
+_BASE_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+if _BASE_DIR not in sys.path:
+    sys.path.append(_BASE_DIR)
+
+from module_utils.dci_compress import (check_compression,  # noqa: E402
+                                       compress, compressed_mime,
+                                       CompressionError)
+from module_utils.dci_env import env_bool, env_number  # noqa: E402
+from module_utils.dci_session import get_context  # noqa: E402
+from module_utils.dci_spool import Spool, SpoolError  # noqa: E402
+from requests.exceptions import ReadTimeout, RequestException  # noqa: E402
 
 COMPAT_OPTIONS = (('display_skipped_hosts', C.DISPLAY_SKIPPED_HOSTS),
                   ('display_ok_hosts', True),
@@ -24,6 +49,299 @@ COMPAT_OPTIONS = (('display_skipped_hosts', C.DISPLAY_SKIPPED_HOSTS),
                   ('result_format', 'json'))
 
 
+class BackgroundUploader(object):
+    """Run the uploads to the DCI control server from dedicated threads.
+
+    Uploads are callables pushed into bounded queues: when the control
+    server is slower than the playbook, submit() blocks and throttles the
+    playbook instead of growing the memory usage without limit. The uploads
+    submitted with the same key are run in order by the same thread, the
+    ones of different keys concurrently by up to workers threads. The
+    exceptions raised by the uploads and the values they return, which
+    describe their failure, are kept in errors."""
+
+    def __init__(self, maxsize=64, workers=1):
+        self.errors = []
+        self._lanes = {}
+        self._queues = []
+        self._threads = []
+        workers = max(1, workers)
+        for idx in range(workers):
+            self._queues.append(queue.Queue(maxsize=max(1,
+                                                        maxsize // workers)))
+            thread = threading.Thread(target=self._run,
+                                      args=(self._queues[-1],),
+                                      name='dci-uploader-%d' % idx)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _run(self, tasks):
+        while True:
+            func = tasks.get()
+            try:
+                if func is None:
+                    return
+                error = func()
+                if error is not None:
+                    self.errors.append(error)
+            except Exception as exc:
+                self.errors.append(str(exc))
+            finally:
+                tasks.task_done()
+
+    def submit(self, func, key=None):
+        # the keys are spread over the threads in the order they come
+        lane = self._lanes.setdefault(key, len(self._lanes) % len(
+            self._queues))
+        self._queues[lane].put(func)
+
+    def pending(self):
+        return sum(tasks.qsize() for tasks in self._queues)
+
+    def close(self, timeout=None):
+        """Wait for the queued uploads to complete and stop the threads.
+
+        Return False if the uploads were not all done before timeout."""
+        deadline = None if timeout is None else time.time() + timeout
+        for tasks, thread in zip(self._queues, self._threads):
+            if deadline is not None:
+                timeout = max(0, deadline - time.time())
+            try:
+                tasks.put(None, timeout=timeout)
+            except queue.Full:
+                return False
+        for thread in self._threads:
+            if deadline is not None:
+                timeout = max(0, deadline - time.time())
+            thread.join(timeout)
+        return not any(thread.is_alive() for thread in self._threads)
+
+
+class OutputBuffer(object):
+    """Accumulate the output of a task as UTF-8 in a file-like object kept
+    in memory up to max_size bytes and spilled to a temporary file past this
+    size, instead of concatenating strings."""
+
+    def __init__(self, max_size):
+        self.size = 0
+        self.error = None
+        self._file = tempfile.SpooledTemporaryFile(max_size=max_size)
+
+    def __len__(self):
+        return self.size
+
+    def write(self, text):
+        try:
+            data = text.encode('UTF-8')
+        except ValueError as ve:
+            if self.error is None:
+                self.error = str(ve)
+            return
+        self._file.write(data)
+        self.size += len(data)
+
+    @property
+    def in_memory(self):
+        return not self._file._rolled
+
+    def rollover(self):
+        """Move the content to a temporary file."""
+        self._file.rollover()
+
+    def getvalue(self):
+        self._file.seek(0)
+        return self._file.read()
+
+    def excerpt(self, head, tail):
+        """Return the first head bytes and the last tail bytes, cut on
+        UTF-8 character boundaries."""
+        self._file.seek(0)
+        first = self._file.read(head)
+        self._file.seek(max(head, self.size - tail))
+        last = self._file.read()
+        return (first.decode('UTF-8', 'ignore').encode('UTF-8'),
+                last.decode('UTF-8', 'ignore').encode('UTF-8'))
+
+    def detach(self):
+        """Return the underlying file object rewound, to stream its content
+        without loading it in memory. The caller has to close it."""
+        self._file.seek(0)
+        return self._file
+
+    def close(self):
+        self._file.close()
+
+
+class OutputBatch(object):
+    """Task outputs waiting to be uploaded together as a single archive."""
+
+    def __init__(self):
+        self.files = []
+        self.size = 0
+        self.started = None
+
+    def __len__(self):
+        return len(self.files)
+
+    @property
+    def jobstate_id(self):
+        return self.files[-1]['jobstate_id'] if self.files else None
+
+    def add(self, kwargs):
+        if not self.files:
+            self.started = time.time()
+        self.files.append(kwargs)
+        self.size += len(kwargs['content'] or '')
+
+    def is_full(self, max_files, max_bytes, window):
+        return (len(self.files) >= max_files or
+                self.size >= max_bytes or
+                time.time() - self.started >= window)
+
+    def to_file_kwargs(self, name):
+        """Build the dci_file.create arguments to upload the batch as a
+        gzipped tarball holding one member per task output, in order."""
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode='w:gz') as tar:
+            for idx, kwargs in enumerate(self.files):
+                content = kwargs['content'] or b''
+                if not isinstance(content, bytes):
+                    content = content.encode('UTF-8')
+                info = tarfile.TarInfo('%04d %s' % (idx, kwargs['name']))
+                info.size = len(content)
+                info.mtime = int(self.started)
+                tar.addfile(info, io.BytesIO(content))
+        return {
+            'name': name,
+            'content': archive.getvalue(),
+            'mime': 'application/gzip',
+            'job_id': self.files[0]['job_id'],
+            'jobstate_id': self.jobstate_id,
+            'digests': [digest for kwargs in self.files
+                        for digest in kwargs.get('digests', [])]
+        }
+
+
+class HostOutput(object):
+    """Output of a task on a host, with the flags used to prefix the name
+    of its file."""
+
+    def __init__(self, name, max_size):
+        self.name = name
+        self._content = OutputBuffer(max_size)
+        self._color = None
+        self._item_failed = False
+        self._item_actioned = False
+        self._warn_prefix = False
+
+
+class OutputArchive(object):
+    """Gzipped tarball of the full task outputs truncated by the output
+    budget, built on the fly in a temporary file."""
+
+    def __init__(self, max_size):
+        self.count = 0
+        self._file = tempfile.SpooledTemporaryFile(max_size=max_size)
+        self._tar = tarfile.open(fileobj=self._file, mode='w:gz')
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    def add(self, name, content):
+        """Add an OutputBuffer as a member, return the member name."""
+        with self._lock:
+            member = '%04d %s' % (self.count, name)
+            info = tarfile.TarInfo(member)
+            info.size = len(content)
+            info.mtime = int(time.time())
+            self._tar.addfile(info, content.detach())
+            self.count += 1
+            return member
+
+    def detach(self):
+        """Finish the archive and return its file object rewound. The
+        caller has to close it."""
+        self._tar.close()
+        self._file.seek(0)
+        return self._file
+
+
+class UploadMetrics(object):
+    """Latency, size and retries of the calls to the control server, per
+    kind of call (file, jobstate), and length of the upload backlog."""
+
+    # upper bounds in seconds of the latency histogram buckets
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float('inf'))
+
+    def __init__(self):
+        self.calls = {}
+        self.backlog_max = 0
+        self._lock = threading.Lock()
+
+    def record(self, kind, latency, size=0, retries=0, failed=False,
+               backlog=0):
+        with self._lock:
+            stats = self.calls.setdefault(kind, {
+                'count': 0, 'failures': 0, 'bytes': 0, 'retries': 0,
+                'time': 0.0, 'max': 0.0,
+                'histogram': [0] * len(self.BUCKETS)})
+            stats['count'] += 1
+            stats['failures'] += int(failed)
+            stats['bytes'] += size
+            stats['retries'] += retries
+            stats['time'] += latency
+            stats['max'] = max(stats['max'], latency)
+            for idx, bound in enumerate(self.BUCKETS):
+                if latency <= bound:
+                    stats['histogram'][idx] += 1
+                    break
+            self.backlog_max = max(self.backlog_max, backlog)
+
+    def percentile(self, kind, ratio):
+        """Return the upper bound of the histogram bucket holding the
+        given ratio of the calls."""
+        stats = self.calls[kind]
+        rank = ratio * stats['count']
+        seen = 0
+        for bound, count in zip(self.BUCKETS, stats['histogram']):
+            seen += count
+            if seen >= rank:
+                return min(bound, stats['max'])
+        return stats['max']
+
+    def summary(self):
+        lines = []
+        for kind in sorted(self.calls):
+            stats = self.calls[kind]
+            lines.append(
+                'dci: %d %s uploads (%d failed, %d retries, %d bytes) in '
+                '%.2fs: avg %.3fs, p50 <= %.3fs, p95 <= %.3fs, max %.3fs' %
+                (stats['count'], kind, stats['failures'], stats['retries'],
+                 stats['bytes'], stats['time'],
+                 stats['time'] / stats['count'],
+                 self.percentile(kind, 0.5), self.percentile(kind, 0.95),
+                 stats['max']))
+        if lines:
+            lines.append('dci: upload backlog peak: %d' % self.backlog_max)
+        return lines
+
+    def to_dict(self):
+        with self._lock:
+            calls = dict((kind, dict(stats))
+                         for kind, stats in self.calls.items())
+        for stats in calls.values():
+            stats['histogram'] = dict(
+                ('+Inf' if bound == float('inf') else str(bound), count)
+                for bound, count in zip(self.BUCKETS, stats['histogram']))
+        return {'calls': calls, 'backlog_max': self.backlog_max}
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2, sort_keys=True)
+
+
 class CallbackModule(CM_default):
     """This callback module uploads the Ansible output to a DCI control
 server."""
@@ -33,6 +351,35 @@ server."""
     CALLBACK_NEEDS_ENABLED = False
     CALLBACK_NEEDS_WHITELIST = True
 
+    # maximum size in bytes of a task output kept in memory
+    _output_limit = 8 * 1024 * 1024
+    # size in bytes above which a task output is streamed to the server
+    _stream_threshold = 1024 * 1024
+    # size in bytes of a task output, and of all the task outputs of the
+    # job, uploaded inline (0 for no limit)
+    _task_output_budget = 0
+    _job_output_budget = 0
+    # maximum size in bytes of the task outputs kept in memory until the
+    # job is known
+    _backlog_limit = 16 * 1024 * 1024
+    # seconds during which a pending jobstate transition is replaced by the
+    # next one instead of being posted
+    _jobstate_window = 5
+    # statuses never replaced by the next transition
+    _final_statuses = ('success', 'failure', 'error', 'killed')
+
+    # per task flags, reset by banner()
+    _item_failed = False
+    _item_actioned = False
+    _warn_prefix = False
+
+    _metrics = None
+    # output of a task on a host being captured, see _host_capture()
+    _host_output = None
+    _per_host = False
+    # jobstate transition (comment, status) not posted yet
+    _pending_jobstate = None
+
     def __init__(self):
 
         super(CallbackModule, self).__init__()
@@ -44,16 +391,88 @@ server."""
         self._jobstate_id = os.getenv("DCI_JOBSTATE_ID")
         self._job_id = os.getenv("DCI_JOB_ID")
         self._current_status = None
+        self._pending_jobstate = None
+        self._pending_since = None
+        self._jobstate_window = env_number('DCI_JOBSTATE_WINDOW',
+                                           self._jobstate_window, float)
+        self._jobstate_lock = threading.RLock()
         self._dci_context = self._build_dci_context()
         self._explicit = self._job_id is not None
         self._backlog = []
+        self._backlog_memory = 0
+        self._backlog_limit = env_number('DCI_BACKLOG_MEMORY_LIMIT',
+                                         self._backlog_limit)
+        self._backlog_workers = env_number('DCI_BACKLOG_WORKERS', 1)
         self._file_backlog = []
+        self._file_backlog_lock = threading.Lock()
         self._name = None
-        self._content = ''
+        self._output_limit = env_number('DCI_OUTPUT_MEMORY_LIMIT',
+                                        self._output_limit)
+        self._content = OutputBuffer(self._output_limit)
+        self._stream_threshold = env_number('DCI_UPLOAD_STREAM_THRESHOLD',
+                                            self._stream_threshold)
+        self._task_output_budget = env_number('DCI_TASK_OUTPUT_BUDGET',
+                                              self._task_output_budget)
+        self._job_output_budget = env_number('DCI_JOB_OUTPUT_BUDGET',
+                                             self._job_output_budget)
+        self._job_output_size = 0
+        self._dedup = env_bool('DCI_DEDUP_OUTPUTS')
+        self._dedup_min_size = env_number('DCI_DEDUP_MIN_SIZE', 1024)
+        self._digests = {}
+        self._digest_lock = threading.Lock()
+        self._digest_index = os.getenv('DCI_DEDUP_INDEX')
+        if self._dedup and self._digest_index:
+            self._load_digests()
+        self._output_archive = None
+        self._output_archive_lock = threading.Lock()
+        # one output per task and host instead of one per task
+        self._per_host = env_bool('DCI_OUTPUT_PER_HOST')
+        self._host_outputs = {}
+        self._host_output = None
         self._color = None
         self._warns = []
         self._warn_prefix = False
         self._item_failed = False
+        self._item_actioned = False
+        self._uploader = None
+        self._shutdown_timeout = env_number('DCI_UPLOAD_SHUTDOWN_TIMEOUT',
+                                            300, float)
+        # the outputs of the hosts are captured concurrently and uploaded
+        # by DCI_UPLOAD_WORKERS background threads, in order for each host
+        if env_bool('DCI_ASYNC_UPLOAD') or self._per_host:
+            self._uploader = BackgroundUploader(
+                env_number('DCI_UPLOAD_QUEUE_SIZE', 64),
+                env_number('DCI_UPLOAD_WORKERS', 4) if self._per_host else 1)
+        self._batch = OutputBatch()
+        self._batch_count = 0
+        self._batch_max_files = env_number('DCI_UPLOAD_BATCH_SIZE', 1)
+        self._batch_max_bytes = env_number('DCI_UPLOAD_BATCH_BYTES',
+                                           1024 * 1024)
+        self._batch_window = env_number('DCI_UPLOAD_BATCH_WINDOW', 30, float)
+        # offline mode: write everything to an archive uploaded later with
+        # module_utils/dci_spool.py instead of calling the control server
+        self._offline = bool(os.getenv('DCI_OFFLINE_ARCHIVE'))
+        self._compression = os.getenv('DCI_UPLOAD_COMPRESSION')
+        if self._offline and not self._compression:
+            self._compression = 'gzip'
+        if self._compression:
+            try:
+                check_compression(self._compression)
+            except CompressionError as exc:
+                self._real_display.warning('dci: %s' % exc.message)
+                self._compression = None
+        self._metrics = UploadMetrics()
+        self._metrics_file = os.getenv('DCI_METRICS_FILE')
+        self._spool = None
+        self._spool_lock = threading.Lock()
+        spool_dir = os.getenv('DCI_OFFLINE_ARCHIVE',
+                              os.getenv('DCI_SPOOL_DIR'))
+        if spool_dir:
+            try:
+                self._spool = self._open_spool(spool_dir)
+            except SpoolError as exc:
+                self._real_display.warning('dci: %s' % exc.message)
+                self._offline = False
 
     def get_option(self, name):
         for key, val in COMPAT_OPTIONS:
@@ -79,12 +498,8 @@ server."""
         login, password, url, client_id, api_secret = self._get_details()
         user_agent = ('Ansible/%s (python-dciclient/%s, python-dciauth/%s)'
                       ) % (ansible_version, dciclient_version, dciauth_version)
-        if login is not None and password is not None:
-            return dci_context.build_dci_context(url, login, password,
-                                                 user_agent)
-        elif client_id is not None and api_secret is not None:
-            return dci_context.build_signature_context(url, client_id,
-                                                       api_secret, user_agent)
+        return get_context(url, login, password, client_id, api_secret,
+                           user_agent)
 
     def warning(self, msg):
         pass
@@ -101,13 +516,13 @@ server."""
             if 'warnings' in res:
                 for warning in res['warnings']:
                     if warning not in self._warns:
-                        self._content += "[WARNING]: " + warning + "\n"
+                        self._content.write("[WARNING]: " + warning + "\n")
                         self._warns.append(warning)
                         self._warn_prefix = True
             if 'deprecations' in res:
                 for warning in res['deprecations']:
                     if warning["msg"] not in self._warns:
-                        self._content += "[DEPRECATION WARNING]: " + warning["msg"] + "\n"
+                        self._content.write("[DEPRECATION WARNING]: " + warning["msg"] + "\n")
                         self._warns.append(warning["msg"])
                         self._warn_prefix = True
 
@@ -120,57 +535,180 @@ server."""
         if color is not None:
             self._color = color
 
-        self._content += msg + '\n'
+        self._content.write(msg)
+        self._content.write('\n')
 
     def banner(self, msg):
         # upload the previous content when we have a new banner (start
         # of task/play/playbook...)
 
+        if self._host_output is not None:
+            # banner printed while displaying a host result
+            output = self._host_output
+            self._leave_host(output)
+            try:
+                return self.banner(msg)
+            finally:
+                self._enter_host(output)
+
         if self._name:
-            if self._color == C.COLOR_SKIP:
-                if self._item_failed:
-                    prefix = 'failed/'
-                elif self._item_actioned:
-                    prefix = ''
-                else:
-                    prefix = 'skipped/'
-            elif self._color == C.COLOR_UNREACHABLE:
-                prefix = "unreachable/"
-            elif self._color == C.COLOR_ERROR or self._item_failed:
-                prefix = "failed/"
+            prefix = self._file_prefix()
+            content = self._content
+            self._content = OutputBuffer(self._output_limit)
+            if self._per_host and not len(content):
+                # the results are in the files of the hosts
+                content.close()
             else:
+                self.create_file(prefix + self._name,
+                                 content if len(content) else ' ')
+
+        self._name = msg
+
+    def _file_prefix(self):
+        """Return the prefix of the name of the file for the current
+        output and reset the flags of the output."""
+        if self._color == C.COLOR_SKIP:
+            if self._item_failed:
+                prefix = 'failed/'
+            elif self._item_actioned:
                 prefix = ''
+            else:
+                prefix = 'skipped/'
+        elif self._color == C.COLOR_UNREACHABLE:
+            prefix = "unreachable/"
+        elif self._color == C.COLOR_ERROR or self._item_failed:
+            prefix = "failed/"
+        else:
+            prefix = ''
 
-            self._item_failed = False
-            self._item_actioned = False
+        self._item_failed = False
+        self._item_actioned = False
 
-            if self._warn_prefix:
-                prefix += "warn/"
-                self._warn_prefix = False
+        if self._warn_prefix:
+            prefix += "warn/"
+            self._warn_prefix = False
+        return prefix
 
-            self.create_file(prefix + self._name,
-                             self._content if self._content != '' else ' ')
-            self._content = ''
+    _HOST_ATTRS = ('_content', '_color', '_item_failed', '_item_actioned',
+                   '_warn_prefix')
 
-        self._name = msg
+    def _swap_output(self, output):
+        for attr in self._HOST_ATTRS:
+            value = getattr(self, attr)
+            setattr(self, attr, getattr(output, attr))
+            setattr(output, attr, value)
 
-    def create_file(self, name, content):
+    def _enter_host(self, output):
+        """Redirect the display to the output of a host."""
+        self._swap_output(output)
+        self._host_output = output
+
+    def _leave_host(self, output):
+        self._swap_output(output)
+        self._host_output = None
+
+    @contextlib.contextmanager
+    def _host_capture(self, result, final=False):
+        """Capture what is displayed for the result of a task on a host in
+        the output of this task and host when DCI_OUTPUT_PER_HOST is set.
+        The output is uploaded with the final result of the host, so the
+        outputs of the hosts do not interleave with strategy free or many
+        forks."""
+        if not self._per_host or self._host_output is not None:
+            yield
+            return
+        host = result._host.get_name()
+        key = (result._task._uuid, host)
+        output = self._host_outputs.pop(key, None)
+        if output is None:
+            name = 'TASK [%s] [%s]' % (self.task_name(result), host)
+            output = HostOutput(name, self._output_limit)
+        self._enter_host(output)
+        try:
+            yield
+        finally:
+            self._leave_host(output)
+            if final:
+                self._upload_host_output(host, output)
+            else:
+                self._host_outputs[key] = output
+
+    def _upload_host_output(self, host, output):
+        self._enter_host(output)
+        prefix = self._file_prefix()
+        self._leave_host(output)
+        if len(output._content):
+            self.create_file(prefix + output.name, output._content, host)
+        else:
+            output._content.close()
+
+    def _flush_host_outputs(self):
+        """Upload the outputs of the hosts whose final result never came,
+        for example when only item or retry results were displayed."""
+        outputs = self._host_outputs
+        self._host_outputs = {}
+        for (_, host), output in outputs.items():
+            self._upload_host_output(host, output)
+
+    def create_file(self, name, content, host=None):
         """If the job ID already exists, create task files for every task in the
         backlog and clear it. If it does not, store the new task content in
-        the backlog."""
+        the backlog. The files of a host are uploaded in order, the ones of
+        different hosts concurrently with DCI_OUTPUT_PER_HOST."""
+        if self._job_id is None and self._spool is None:
+            self._add_to_backlog(name, content)
+            return
+
+        kwargs = self._file_kwargs(name, content)
         if self._job_id is None:
-            self._backlog.append({'name': name, 'content': content})
+            # uploaded by process_backlog() once the job is known
+            self._spool_file(kwargs)
             return
 
+        kwargs['jobstate_id'] = self._resolve_jobstate()
+        if self._batch_max_files > 1:
+            if not hasattr(kwargs['content'], 'read'):
+                return self._add_to_batch(kwargs)
+            # large outputs are streamed on their own, after the current
+            # batch to keep the order of the tasks
+            self._flush_batch()
+        return self._submit_upload(kwargs, host)
+
+    def _add_to_backlog(self, name, content):
+        """Keep a task output until the job is known. Past
+        DCI_BACKLOG_MEMORY_LIMIT bytes held in memory by the backlog, the
+        outputs are moved to temporary files."""
+        if isinstance(content, OutputBuffer) and content.in_memory:
+            if self._backlog_memory + len(content) > self._backlog_limit:
+                content.rollover()
+            else:
+                self._backlog_memory += len(content)
+        self._backlog.append({'name': name, 'content': content})
+
+    def _file_kwargs(self, name, content):
+        """Build the dci_file.create arguments of a task output."""
+        if isinstance(content, OutputBuffer) and content.error is None:
+            content = self._apply_output_budget(name, content)
+
         def _content_to_utf8():
+            if isinstance(content, bytes):
+                return name, content
+            if isinstance(content, OutputBuffer):
+                if content.error is not None:
+                    content.close()
+                    return "warn/%s" % name, "invalid content, not able to encode to utf-8: %s" % content.error
+                if len(content) > self._stream_threshold:
+                    return name, content.detach()
+                try:
+                    return name, content.getvalue()
+                finally:
+                    content.close()
             try:
                 return name, content and content.encode('UTF-8')
             except ValueError as ve:
                 return "warn/%s" % name, "invalid content, not able to encode to utf-8: %s" % str(ve)
 
         name, content = _content_to_utf8()
-        if self._jobstate_id is None:
-            self.create_jobstate("implicit new state", "new", True)
 
         # Restrict name to 255 characters by truncating the path at the beginning.
         # Example: TASK [<very long path> : Get pods from example-cnf namespace]
@@ -187,6 +725,9 @@ server."""
             # fallback if the name didn't respect the expected format
             if len(name) > 255:
                 name = name[:255]
+        digests = []
+        if self._dedup and self._job_id is not None:
+            content, digests = self._dedup_content(name, content)
         kwargs = {
             'name': name,
             'content': content,
@@ -194,37 +735,365 @@ server."""
             'job_id': self._job_id,
             'jobstate_id': self._jobstate_id
         }
-        for idx in range(len(self._file_backlog)):
-            ret = dci_file.create(self._dci_context,
-                                  **self._file_backlog[idx])
-            if ret.status_code // 100 != 2:
-                self._file_backlog = self._file_backlog[idx:]
-                self._file_backlog.append(kwargs)
-                return "warn/%s" % name, "failed to create file: %s" % ret.text
-        self._file_backlog = []
-        ret = dci_file.create(self._dci_context, **kwargs)
+        if digests:
+            kwargs['digests'] = digests
+        # batches are compressed archives already
+        if self._compression and (self._batch_max_files <= 1 or
+                                  hasattr(content, 'read')):
+            self._compress(kwargs)
+        return kwargs
+
+    def _dedup_content(self, name, content):
+        """Replace a task output identical to one already sent for the job
+        by a reference to the first task with this output. Return the
+        content and the digests to record once it is uploaded."""
+        digest = hashlib.sha256()
+        if hasattr(content, 'read'):
+            size = 0
+            for chunk in iter(lambda: content.read(64 * 1024), b''):
+                digest.update(chunk)
+                size += len(chunk)
+            content.seek(0)
+        elif isinstance(content, bytes):
+            digest.update(content)
+            size = len(content)
+        else:
+            return content, []
+        if size < self._dedup_min_size:
+            return content, []
+        key = (self._job_id, digest.hexdigest())
+        with self._digest_lock:
+            first = self._digests.get(key)
+        if first is None:
+            return content, [[key[0], key[1], name]]
+        if hasattr(content, 'close'):
+            content.close()
+        return ('[same output as "%s", sha256:%s]\n' %
+                (first, key[1])).encode('UTF-8'), []
+
+    def _load_digests(self):
+        """Read the digests sent by the previous playbooks of the job, one
+        JSON list [job id, digest, task name] per line."""
+        try:
+            with open(self._digest_index) as f:
+                for line in f:
+                    try:
+                        job_id, digest, name = json.loads(line)
+                    except ValueError:
+                        continue
+                    self._digests[(job_id, digest)] = name
+        except (IOError, OSError):
+            pass
+
+    def _save_digest(self, job_id, digest, name):
+        """Record the digest of a task output accepted by the control
+        server."""
+        with self._digest_lock:
+            if (job_id, digest) in self._digests:
+                return
+            self._digests[(job_id, digest)] = name
+            if not self._digest_index:
+                return
+            try:
+                with open(self._digest_index, 'a') as f:
+                    f.write(json.dumps([job_id, digest, name]) + '\n')
+            except (IOError, OSError) as exc:
+                self._real_display.warning('dci: unable to write %s: %s' %
+                                           (self._digest_index, exc))
+                self._digest_index = None
+
+    def _apply_output_budget(self, name, content):
+        """Keep the task output within DCI_TASK_OUTPUT_BUDGET and what is
+        left of DCI_JOB_OUTPUT_BUDGET. Past the budget, the head and the
+        tail of the output are uploaded inline and the full output goes
+        to the archive uploaded at the end of the playbook."""
+        if not self._task_output_budget and not self._job_output_budget:
+            return content
+        with self._output_archive_lock:
+            budget = self._task_output_budget
+            if self._job_output_budget:
+                left = max(0, self._job_output_budget - self._job_output_size)
+                budget = min(budget, left) if budget else left
+            if len(content) <= budget:
+                self._job_output_size += len(content)
+                return content
+            if self._output_archive is None:
+                self._output_archive = OutputArchive(self._output_limit)
+            self._job_output_size += budget
+        member = self._output_archive.add(name, content)
+        head, tail = content.excerpt(budget // 2, budget - budget // 2)
+        content.close()
+        return b''.join((
+            head,
+            ('\n[... %d bytes truncated, full output in %s of '
+             'ansible-full-outputs.tar.gz ...]\n' %
+             (len(content) - len(head) - len(tail), member)).encode('UTF-8'),
+            tail))
+
+    def _upload_output_archive(self):
+        if self._output_archive is None or self._job_id is None:
+            return
+        archive = self._output_archive
+        self._output_archive = None
+        self._submit_upload({
+            'name': 'ansible-full-outputs.tar.gz',
+            'content': archive.detach(),
+            'mime': 'application/gzip',
+            'job_id': self._job_id,
+            'jobstate_id': self._resolve_jobstate()
+        })
+
+    def _compress(self, kwargs):
+        content = kwargs['content'] or b''
+        if not isinstance(content, bytes) and not hasattr(content, 'read'):
+            content = content.encode('UTF-8')
+        kwargs['content'] = compress(content, self._compression)
+        kwargs['mime'] = compressed_mime(kwargs['mime'], self._compression)
+        if hasattr(content, 'close'):
+            content.close()
+
+    def _submit_upload(self, kwargs, host=None):
+        if self._offline:
+            return self._spool_file(kwargs)
+        if self._spool is not None:
+            self._spool_file(kwargs)
+            upload = self._drain_spool
+        else:
+            def upload():
+                return self._upload_file(kwargs)
+        if self._uploader is not None:
+            self._uploader.submit(upload, host)
+            return
+        return upload()
+
+    def _add_to_batch(self, kwargs):
+        """Coalesce the task outputs to amortize the cost of a request over
+        several tasks. A batch is sent when it reaches
+        DCI_UPLOAD_BATCH_SIZE files or DCI_UPLOAD_BATCH_BYTES bytes, when it
+        is older than DCI_UPLOAD_BATCH_WINDOW seconds (checked at each task
+        boundary) or when the jobstate changes."""
+        if self._batch and self._batch.jobstate_id != kwargs['jobstate_id']:
+            self._flush_batch()
+        self._batch.add(kwargs)
+        if self._batch.is_full(self._batch_max_files, self._batch_max_bytes,
+                               self._batch_window):
+            return self._flush_batch()
+
+    def _flush_batch(self):
+        if not self._batch:
+            return
+        self._batch_count += 1
+        kwargs = self._batch.to_file_kwargs(
+            'ansible-outputs-%04d.tar.gz' % self._batch_count)
+        self._batch = OutputBatch()
+        return self._submit_upload(kwargs)
+
+    def _upload_file(self, kwargs):
+        """Upload the pending files then the new one. On failure, keep the
+        files in the backlog to retry them on the next upload. The uploads
+        of the other hosts wait for the backlog to be retried, so the files
+        of a host stay in order."""
+        name = kwargs['name']
+        with self._file_backlog_lock:
+            for idx in range(len(self._file_backlog)):
+                error, _ = self._send_file(self._file_backlog[idx])
+                if error is not None:
+                    self._file_backlog = self._file_backlog[idx:]
+                    self._file_backlog.append(kwargs)
+                    return ("warn/%s" % name,
+                            "failed to create file: %s" % error)
+            self._file_backlog = []
+        error, transient = self._send_file(kwargs)
+        if error is not None:
+            if transient:
+                with self._file_backlog_lock:
+                    self._file_backlog.append(kwargs)
+            return "warn/%s" % name, "failed to create file: %s" % error
+
+    def _send_file(self, kwargs):
+        """Return a tuple (error, transient) with error set to None when the
+        file has been uploaded.
+
+        The content can be a file object which is streamed to the server,
+        and closed once uploaded. The digests of the deduplicated outputs it
+        holds are recorded once uploaded."""
+        kwargs = dict(kwargs)
+        digests = kwargs.pop('digests', [])
+        content = kwargs['content']
+        if hasattr(content, 'seek'):
+            content.seek(0, os.SEEK_END)
+            size = content.tell()
+            content.seek(0)
+        else:
+            size = len(content or '')
+        try:
+            ret = self._timed_call('file', size, dci_file.create,
+                                   self._dci_context, **kwargs)
+        except RequestException as exc:
+            # after a read timeout, the file may have been created
+            return str(exc), not isinstance(exc, ReadTimeout)
         if ret.status_code // 100 != 2:
-            return "warn/%s" % name, "failed to create file: %s" % ret.text
+            return ret.text, (ret.status_code >= 500 or
+                              ret.status_code == 429)
+        if hasattr(content, 'close'):
+            content.close()
+        for job_id, digest, name in digests:
+            self._save_digest(job_id, digest, name)
+        return None, False
+
+    def _backlog_length(self):
+        length = len(self._file_backlog)
+        if self._uploader is not None:
+            length += self._uploader.pending()
+        return length
+
+    def _timed_call(self, kind, size, func, *args, **kwargs):
+        """Call func, an API call, recording its latency and retries."""
+        if self._metrics is None:
+            return func(*args, **kwargs)
+        policy = getattr(getattr(self._dci_context, 'session', None),
+                         'retry_policy', None)
+        retries = policy.retries if policy is not None else 0
+        failed = True
+        start = time.time()
+        try:
+            ret = func(*args, **kwargs)
+            failed = ret.status_code // 100 != 2
+            return ret
+        finally:
+            if policy is not None:
+                retries = policy.retries - retries
+            self._metrics.record(kind, time.time() - start, size, retries,
+                                 failed, self._backlog_length())
+
+    @staticmethod
+    def _open_spool(directory):
+        """Open the spool of directory. The records of a previous run
+        captured before its job was known would be attached to the job of
+        this run: refuse the spool until they are uploaded to their job with
+        module_utils/dci_spool.py --job-id."""
+        spool = Spool(directory)
+        for _, record, _ in spool:
+            if not record.get('job_id'):
+                spool.close()
+                raise SpoolError(
+                    '%s holds records of a previous run without job, upload '
+                    'them with dci_spool.py --job-id' % directory)
+        return spool
+
+    def _spool_file(self, kwargs):
+        record = dict(kwargs, type='file')
+        del record['content']
+        self._spool.append(record, kwargs['content'] or b'')
+        if hasattr(kwargs['content'], 'close'):
+            kwargs['content'].close()
+
+    def _drain_spool(self):
+        """Upload the records of the spool in order. Stop at the first
+        transient failure: the remaining records stay on disk and are
+        retried at the next upload, or can be replayed later with
+        module_utils/dci_spool.py. A record rejected by the control server
+        is dropped with a warning as it would never be accepted.
+        """
+        with self._spool_lock:
+            for position, record, payload in self._spool:
+                if record['type'] == 'jobstate':
+                    self.create_jobstate(record['comment'], record['status'])
+                    self._spool.ack(position)
+                    continue
+                error, transient = self._send_file({
+                    'name': record['name'],
+                    'content': payload,
+                    'mime': record['mime'],
+                    'job_id': record['job_id'] or self._job_id,
+                    'jobstate_id': (record['jobstate_id'] or
+                                    self._resolve_jobstate()),
+                    'digests': record.get('digests', [])
+                })
+                if error is not None:
+                    if transient:
+                        return ("warn/%s" % record['name'],
+                                "failed to create file: %s" % error)
+                    self._real_display.warning(
+                        'dci: %s rejected, removed from the spool: %s' %
+                        (record['name'], error))
+                self._spool.ack(position)
 
     def create_jobstate(self, comment, status, force=False):
+        """Record a jobstate transition. The transitions to the status
+        already reached are dropped and the last transition is posted only
+        when a file needs a jobstate id, when the next transition happens
+        more than DCI_JOBSTATE_WINDOW seconds later or at the end of the
+        playbook. A transition to a final status is always posted."""
         if self._explicit and not force:
             return
 
-        if not status or self._current_status == status:
-            return
+        with self._jobstate_lock:
+            if not status or self._next_status() == status:
+                return
 
-        if self._job_id is None:
-            self._backlog.append({'comment': comment, 'status': status})
+            if self._job_id is None:
+                if self._spool is not None:
+                    self._spool.append({'type': 'jobstate',
+                                        'comment': comment,
+                                        'status': status})
+                else:
+                    self._backlog.append({'comment': comment,
+                                          'status': status})
+                return
+
+            now = time.time()
+            if self._pending_jobstate is not None and (
+                    self._pending_jobstate[1] in self._final_statuses or
+                    now - self._pending_since >= self._jobstate_window):
+                self._post_jobstate(*self._pending_jobstate)
+            if status == self._current_status:
+                # back to the posted status before anything happened
+                self._pending_jobstate = None
+                return
+            self._pending_jobstate = (comment, status)
+            self._pending_since = now
+
+    def _next_status(self):
+        if self._pending_jobstate is not None:
+            return self._pending_jobstate[1]
+        return self._current_status
+
+    def _resolve_jobstate(self):
+        """Post the pending jobstate transition, or an implicit one when
+        the job has no jobstate yet, and return the current jobstate id."""
+        with self._jobstate_lock:
+            if self._pending_jobstate is None and self._jobstate_id is None:
+                self._pending_jobstate = ("implicit new state", "new")
+            if self._pending_jobstate is not None:
+                self._post_jobstate(*self._pending_jobstate)
+            return self._jobstate_id
+
+    def _post_jobstate(self, comment, status):
+        if self._offline:
+            # the files refer to this local id, replaced by the id of the
+            # jobstate created when the archive is uploaded
+            self._jobstate_id = 'offline-%s' % uuid.uuid4()
+            self._current_status = status
+            self._pending_jobstate = None
+            self._spool.append({'type': 'jobstate', 'id': self._jobstate_id,
+                                'comment': comment, 'status': status,
+                                'job_id': self._job_id})
             return
 
+        try:
+            r = self._timed_call(
+                'jobstate', 0, dci_jobstate.create,
+                self._dci_context,
+                status=status,
+                comment=comment,
+                job_id=self._job_id
+            )
+        except RequestException:
+            # keep the transition pending to retry it with the next file
+            return
         self._current_status = status
-
-        r = dci_jobstate.create(
-            self._dci_context,
-            status=self._current_status,
-            comment=comment,
-            job_id=self._job_id
-        )
+        self._pending_jobstate = None
         ns = r.json()
         if 'jobstate' in ns and 'id' in ns['jobstate']:
             self._jobstate_id = ns['jobstate']['id']
@@ -232,8 +1101,73 @@ server."""
 
     def v2_playbook_on_stats(self, stats):
         super(CallbackModule, self).v2_playbook_on_stats(stats)
+        self._flush_host_outputs()
         # do a fake call to banner to output the last content
         self.banner('')
+        # post the final status even without file attached to it
+        if self._job_id is not None and self._pending_jobstate is not None:
+            self._resolve_jobstate()
+        self._flush_batch()
+        self._upload_output_archive()
+        self._drain_uploads()
+        self._retry_file_backlog()
+        self._close_spool()
+        self._report_metrics()
+
+    def _report_metrics(self):
+        if self._metrics is None:
+            return
+        for line in self._metrics.summary():
+            self._real_display.display(line)
+        if self._metrics_file:
+            try:
+                self._metrics.dump(self._metrics_file)
+            except (IOError, OSError) as exc:
+                self._real_display.warning(
+                    'dci: unable to write %s: %s' % (self._metrics_file, exc))
+
+    def _drain_uploads(self):
+        if self._uploader is None:
+            return
+        if not self._uploader.close(self._shutdown_timeout):
+            self._real_display.warning(
+                'dci: %d task outputs not uploaded after %s seconds' %
+                (self._uploader.pending(), self._shutdown_timeout))
+        for error in self._uploader.errors:
+            if isinstance(error, tuple):
+                # (warn/<name>, message) returned by _upload_file()
+                error = '%s: %s' % (error[0][len('warn/'):], error[1])
+            self._real_display.warning('dci: upload failed: %s' % error)
+        self._uploader = None
+
+    def _retry_file_backlog(self):
+        """Retry once the files kept after a transient error, which are
+        otherwise only retried with the next upload, and warn about the
+        ones which still fail."""
+        with self._file_backlog_lock:
+            backlog = self._file_backlog
+            self._file_backlog = []
+            for kwargs in backlog:
+                error, _ = self._send_file(kwargs)
+                if error is None:
+                    continue
+                self._real_display.warning('dci: %s not uploaded: %s' %
+                                           (kwargs['name'], error))
+                if hasattr(kwargs['content'], 'close'):
+                    kwargs['content'].close()
+
+    def _close_spool(self):
+        if self._spool is None:
+            return
+        if self._offline:
+            self._real_display.display(
+                'dci: offline archive written in %s' % self._spool.directory)
+        elif not self._spool.is_empty():
+            self._real_display.warning(
+                'dci: some task outputs were not uploaded, they are kept in '
+                '%s' % self._spool.directory)
+        self._spool.close()
+        self._spool = None
 
     def v2_runner_on_ok(self, result, **kwargs):
         """Event executed after each command when it succeed. Get the output
@@ -252,6 +1186,7 @@ server."""
         if ("jobstate" in result._result and
            "id" in result._result["jobstate"]):
             self._jobstate_id = result._result["jobstate"]["id"]
+            self._pending_jobstate = None
             self._explicit = True
             os.environ["DCI_JOBSTATE_ID"] = self._jobstate_id
 
@@ -283,18 +1218,60 @@ server."""
             self._job_id = result._result['job']['id']
             self.process_backlog()
 
-        super(CallbackModule, self).v2_runner_on_ok(result, **kwargs)
+        with self._host_capture(result, final=True):
+            super(CallbackModule, self).v2_runner_on_ok(result, **kwargs)
 
     def process_backlog(self):
         self.create_jobstate(comment='start up', status='new')
 
-        for rec in self._backlog:
-            if 'status' in rec:
-                self.create_jobstate(rec['comment', rec['status']])
-            else:
-                self.create_file(rec['name'],
-                                 rec['content'])
+        if self._spool is not None:
+            if not self._offline:
+                self._drain_spool()
+            return
+
+        backlog = self._backlog
         self._backlog = []
+        self._backlog_memory = 0
+        if (self._backlog_workers <= 1 or self._batch_max_files > 1 or
+                self._uploader is not None):
+            # the batches and the background uploader keep the order
+            for rec in backlog:
+                if 'status' in rec:
+                    self.create_jobstate(rec['comment'], rec['status'])
+                else:
+                    self.create_file(rec['name'],
+                                     rec['content'])
+            return
+
+        files = []
+        for rec in backlog + [None]:
+            if rec is not None and 'status' not in rec:
+                files.append(rec)
+                continue
+            self._upload_backlog_files(files)
+            files = []
+            if rec is not None:
+                self.create_jobstate(rec['comment'], rec['status'])
+
+    def _upload_backlog_files(self, files):
+        """Upload task outputs of the backlog with DCI_BACKLOG_WORKERS
+        concurrent requests. The files failing on a transient error are
+        retried with the next upload."""
+        if not files:
+            return
+        self._resolve_jobstate()
+
+        def _upload(rec):
+            # the outputs are read by the workers, not all at once
+            kwargs = self._file_kwargs(rec['name'], rec['content'])
+            error, transient = self._send_file(kwargs)
+            if error is not None and transient:
+                return kwargs
+
+        with ThreadPoolExecutor(self._backlog_workers) as executor:
+            for kwargs in executor.map(_upload, files):
+                if kwargs is not None:
+                    self._file_backlog.append(kwargs)
 
     def v2_playbook_on_play_start(self, play):
         """Event executed before each play. Create a new jobstate and save
@@ -345,7 +1322,8 @@ server."""
 
     def v2_runner_on_unreachable(self, result):
         self.create_jobstate(comment=self.task_name(result), status='failure')
-        super(CallbackModule, self).v2_runner_on_unreachable(result)
+        with self._host_capture(result, final=True):
+            super(CallbackModule, self).v2_runner_on_unreachable(result)
 
     def v2_runner_on_failed(self, result, ignore_errors=False):
         """Event executed after each command when it fails. Get the output
@@ -355,18 +1333,34 @@ server."""
             self.create_jobstate(comment=self.task_name(result),
                                  status='failure')
 
-        super(CallbackModule, self).v2_runner_on_failed(result, ignore_errors)
+        with self._host_capture(result, final=True):
+            super(CallbackModule, self).v2_runner_on_failed(result,
+                                                            ignore_errors)
 
     def v2_runner_item_on_failed(self, result):
         """When a loop item fails, enable a flag for the banner to be formatted
         accordingly.
         """
-        self._item_failed = True
-        super(CallbackModule, self).v2_runner_item_on_failed(result)
+        with self._host_capture(result):
+            self._item_failed = True
+            super(CallbackModule, self).v2_runner_item_on_failed(result)
 
     def v2_runner_item_on_ok(self, result):
         """When a loop item completes, enable a flag for the banner to be
         formatted accordingly.
         """
-        self._item_actioned = True
-        super(CallbackModule, self).v2_runner_item_on_ok(result)
+        with self._host_capture(result):
+            self._item_actioned = True
+            super(CallbackModule, self).v2_runner_item_on_ok(result)
+
+    def v2_runner_item_on_skipped(self, result):
+        with self._host_capture(result):
+            super(CallbackModule, self).v2_runner_item_on_skipped(result)
+
+    def v2_runner_on_skipped(self, result):
+        with self._host_capture(result, final=True):
+            super(CallbackModule, self).v2_runner_on_skipped(result)
+
+    def v2_runner_retry(self, result):
+        with self._host_capture(result):
+            super(CallbackModule, self).v2_runner_retry(result)
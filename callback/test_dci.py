@@ -1,9 +1,18 @@
-from callback.dci import CallbackModule
+import gzip
+import io
+import json
+import tarfile
+import threading
+
+from requests.exceptions import ConnectionError, ReadTimeout
+
+from callback import dci
 from ansible import constants as C
+from ansible.plugins.callback.default import CallbackModule as CM_default
 
 
 def test_banner_success():
-    cb = CallbackModule()
+    cb = dci.CallbackModule()
     cb.banner("a message")
 
     assert (cb._name == "a message")
@@ -11,9 +20,9 @@ def test_banner_success():
 
 def test_banner_error():
 
-    class MyCallback(CallbackModule):
+    class MyCallback(dci.CallbackModule):
         def __init__(self):
-            super(CallbackModule, self).__init__()
+            super(dci.CallbackModule, self).__init__()
             self._color = C.COLOR_ERROR
             self._name = 'a_name'
             self._content = 'this is the content'
@@ -30,9 +39,9 @@ def test_banner_error():
 
 def test_banner_error_loop():
 
-    class MyCallback(CallbackModule):
+    class MyCallback(dci.CallbackModule):
         def __init__(self):
-            super(CallbackModule, self).__init__()
+            super(dci.CallbackModule, self).__init__()
             self._color = C.COLOR_CHANGED
             self._name = 'a_name'
             self._content = """changed: [localhost] => (item=file1)
@@ -49,3 +58,681 @@ changed: [localhost] => (item=file5)"""
     cb.banner("a message")
 
     assert (cb.filename == "failed/a_name")
+
+
+def test_background_uploader_drain():
+    uploaded = []
+    uploader = dci.BackgroundUploader(maxsize=2)
+    for idx in range(5):
+        uploader.submit(lambda idx=idx: uploaded.append(idx))
+
+    assert uploader.close(timeout=5)
+    assert uploaded == [0, 1, 2, 3, 4]
+
+
+def test_background_uploader_errors():
+
+    def failing_upload():
+        raise Exception('connection refused')
+
+    uploader = dci.BackgroundUploader()
+    uploader.submit(failing_upload)
+    uploader.submit(lambda: None)
+    uploader.submit(lambda: ('warn/a task', 'failed to create file: 413'))
+
+    assert uploader.close(timeout=5)
+    assert uploader.errors == ['connection refused',
+                               ('warn/a task', 'failed to create file: 413')]
+
+
+def test_create_file_async_errors(monkeypatch):
+    warnings = []
+    monkeypatch.setenv('DCI_ASYNC_UPLOAD', '1')
+    monkeypatch.setenv('DCI_JOB_ID', 'job')
+    monkeypatch.setenv('DCI_JOBSTATE_ID', 'jobstate')
+
+    class Response(object):
+        status_code = 413
+        text = 'too large'
+
+    monkeypatch.setattr(dci.dci_file, 'create',
+                        lambda context, **kwargs: Response())
+    cb = dci.CallbackModule()
+    monkeypatch.setattr(cb._real_display, 'warning', warnings.append)
+    cb.create_file('a task', 'content')
+    cb._drain_uploads()
+
+    assert warnings == ['dci: upload failed: a task: failed to create file: '
+                        'too large']
+
+
+def test_create_file_async(monkeypatch):
+    uploaded = []
+    monkeypatch.setenv('DCI_ASYNC_UPLOAD', '1')
+    monkeypatch.setenv('DCI_JOB_ID', 'job')
+    monkeypatch.setenv('DCI_JOBSTATE_ID', 'jobstate')
+
+    class MyCallback(dci.CallbackModule):
+        def _upload_file(self, kwargs):
+            uploaded.append(kwargs['name'])
+
+    cb = MyCallback()
+    cb.create_file('a task', 'content')
+    cb._drain_uploads()
+
+    assert uploaded == ['a task']
+
+
+def test_create_file_batch(monkeypatch):
+    uploaded = []
+    monkeypatch.setenv('DCI_UPLOAD_BATCH_SIZE', '2')
+    monkeypatch.setenv('DCI_JOB_ID', 'job')
+    monkeypatch.setenv('DCI_JOBSTATE_ID', 'jobstate')
+
+    class MyCallback(dci.CallbackModule):
+        def _upload_file(self, kwargs):
+            uploaded.append(kwargs)
+
+    cb = MyCallback()
+    for idx in range(3):
+        cb.create_file('task %d' % idx, 'content %d' % idx)
+    cb._flush_batch()
+
+    assert [f['name'] for f in uploaded] == ['ansible-outputs-0001.tar.gz',
+                                             'ansible-outputs-0002.tar.gz']
+    tar = tarfile.open(fileobj=io.BytesIO(uploaded[0]['content']))
+    assert tar.getnames() == ['0000 task 0', '0001 task 1']
+    assert tar.extractfile('0001 task 1').read() == b'content 1'
+    assert uploaded[0]['jobstate_id'] == 'jobstate'
+
+
+def test_spool_backlog(monkeypatch, tmpdir):
+    uploaded = []
+    monkeypatch.setenv('DCI_SPOOL_DIR', str(tmpdir))
+    monkeypatch.delenv('DCI_JOB_ID', raising=False)
+    monkeypatch.delenv('DCI_JOBSTATE_ID', raising=False)
+
+    class Response(object):
+        status_code = 201
+
+    def create(context, **kwargs):
+        uploaded.append((kwargs['name'], kwargs['content'],
+                         kwargs['job_id'], kwargs['jobstate_id']))
+        return Response()
+
+    class MyCallback(dci.CallbackModule):
+        def create_jobstate(self, comment, status, force=False):
+            self._jobstate_id = 'jobstate'
+
+    monkeypatch.setattr(dci.dci_file, 'create', create)
+    cb = MyCallback()
+    cb.create_file('a task', 'content')
+    assert uploaded == []
+
+    cb._job_id = 'job'
+    cb.process_backlog()
+    assert uploaded == [('a task', b'content', 'job', 'jobstate')]
+    assert cb._spool.is_empty()
+
+
+def test_spool_previous_run(monkeypatch, tmpdir):
+    warnings = []
+    monkeypatch.setenv('DCI_SPOOL_DIR', str(tmpdir))
+    monkeypatch.delenv('DCI_JOB_ID', raising=False)
+    monkeypatch.delenv('DCI_JOBSTATE_ID', raising=False)
+    monkeypatch.setattr(dci.dci_file, 'create', None)
+
+    # a run killed before its job was known
+    cb = dci.CallbackModule()
+    cb.create_file('prepare run 1', 'content')
+    cb._spool.close()
+    # the display shared by the callbacks
+    monkeypatch.setattr(cb._real_display, 'warning', warnings.append)
+
+    cb = dci.CallbackModule()
+    assert cb._spool is None
+    assert warnings == ['dci: %s holds records of a previous run without '
+                        'job, upload them with dci_spool.py --job-id' %
+                        tmpdir]
+    records = [record['name'] for _, record, _ in dci.Spool(str(tmpdir))]
+    assert records == ['prepare run 1']
+
+
+def test_spool_rejected(monkeypatch, tmpdir):
+    uploaded = []
+    warnings = []
+    monkeypatch.setenv('DCI_SPOOL_DIR', str(tmpdir))
+    monkeypatch.setenv('DCI_JOB_ID', 'job')
+    monkeypatch.setenv('DCI_JOBSTATE_ID', 'jobstate')
+    statuses = {'too large': 413, 'unavailable': 503}
+
+    class Response(object):
+        text = 'error'
+
+        def __init__(self, status_code):
+            self.status_code = status_code
+
+    def create(context, **kwargs):
+        uploaded.append(kwargs['name'])
+        return Response(statuses.pop(kwargs['name'], 201))
+
+    monkeypatch.setattr(dci.dci_file, 'create', create)
+    cb = dci.CallbackModule()
+    monkeypatch.setattr(cb._real_display, 'warning', warnings.append)
+    for name in ('first', 'too large', 'second', 'unavailable', 'last'):
+        cb.create_file(name, 'content')
+
+    assert uploaded == ['first', 'too large', 'second', 'unavailable',
+                        'unavailable', 'last']
+    assert warnings == ['dci: too large rejected, removed from the spool: '
+                        'error']
+    assert cb._spool.is_empty()
+
+
+def test_retry_file_backlog(monkeypatch):
+    uploaded = []
+    warnings = []
+    monkeypatch.setenv('DCI_JOB_ID', 'job')
+    monkeypatch.setenv('DCI_JOBSTATE_ID', 'jobstate')
+    monkeypatch.delenv('DCI_ASYNC_UPLOAD', raising=False)
+    # the last outputs of the run fail on a control server blip
+    statuses = {'down': [503, 503, 503]}
+
+    class Response(object):
+        text = 'unavailable'
+
+        def __init__(self, status_code):
+            self.status_code = status_code
+
+    def create(context, **kwargs):
+        status_code = (statuses.get(kwargs['name']) or [201]).pop(0)
+        if status_code == 201:
+            uploaded.append(kwargs['name'])
+        return Response(status_code)
+
+    monkeypatch.setattr(dci.dci_file, 'create', create)
+    monkeypatch.setattr(CM_default, 'v2_playbook_on_stats',
+                        lambda self, stats: None)
+    cb = dci.CallbackModule()
+    monkeypatch.setattr(cb._real_display, 'warning', warnings.append)
+    cb.create_file('first', 'content')
+    cb.create_file('down', 'content')
+    cb.create_file('last', 'content')
+    assert uploaded == ['first']
+
+    cb.v2_playbook_on_stats(None)
+    assert uploaded == ['first', 'last']
+    assert warnings == ['dci: down not uploaded: unavailable']
+    assert cb._file_backlog == []
+
+
+def test_output_buffer_spill():
+    buf = dci.OutputBuffer(max_size=10)
+    buf.write('0123456789')
+    assert not buf._file._rolled
+    buf.write(u'é')
+    assert buf._file._rolled
+    assert len(buf) == 12
+    assert buf.getvalue() == u'0123456789é'.encode('UTF-8')
+
+
+def test_output_buffer_invalid_utf8():
+    buf = dci.OutputBuffer(max_size=10)
+    buf.write('valid')
+    buf.write(u'\udcff')
+    assert buf.error is not None
+    assert buf.getvalue() == b'valid'
+
+
+def test_display_banner(monkeypatch):
+    files = []
+
+    class MyCallback(dci.CallbackModule):
+        def create_file(self, name, content):
+            files.append((name, content.getvalue()))
+
+    cb = MyCallback()
+    cb.banner('TASK [a task]')
+    cb.display('line 1')
+    cb.display('line 2', screen_only=True)
+    cb.display('line 3')
+    cb.banner('TASK [another task]')
+
+    assert files == [('TASK [a task]', b'line 1\nline 3\n')]
+    assert len(cb._content) == 0
+
+
+def test_create_file_stream(monkeypatch):
+    uploaded = []
+    monkeypatch.setenv('DCI_UPLOAD_STREAM_THRESHOLD', '4')
+    monkeypatch.setenv('DCI_JOB_ID', 'job')
+    monkeypatch.setenv('DCI_JOBSTATE_ID', 'jobstate')
+
+    class Response(object):
+        status_code = 201
+
+    def create(context, **kwargs):
+        content = kwargs['content']
+        uploaded.append((content, content.read()
+                         if hasattr(content, 'read') else content))
+        return Response()
+
+    monkeypatch.setattr(dci.dci_file, 'create', create)
+    cb = dci.CallbackModule()
+    for content in ('tiny', 'large output'):
+        buf = dci.OutputBuffer(max_size=8)
+        buf.write(content)
+        cb.create_file('a task', buf)
+
+    assert uploaded[0] == (b'tiny', b'tiny')
+    assert uploaded[1][0].closed
+    assert uploaded[1][1] == b'large output'
+
+
+def test_create_file_compressed(monkeypatch):
+    uploaded = []
+    monkeypatch.setenv('DCI_UPLOAD_COMPRESSION', 'gzip')
+    monkeypatch.setenv('DCI_JOB_ID', 'job')
+    monkeypatch.setenv('DCI_JOBSTATE_ID', 'jobstate')
+
+    class MyCallback(dci.CallbackModule):
+        def _upload_file(self, kwargs):
+            uploaded.append(kwargs)
+
+    cb = MyCallback()
+    cb.create_file('a task', 'content')
+
+    assert uploaded[0]['mime'] == 'application/x-ansible-output+gzip'
+    assert gzip.decompress(uploaded[0]['content']) == b'content'
+
+
+def test_offline_archive(monkeypatch, tmpdir):
+    monkeypatch.setenv('DCI_OFFLINE_ARCHIVE', str(tmpdir))
+    monkeypatch.setenv('DCI_JOB_ID', 'job')
+    monkeypatch.delenv('DCI_JOBSTATE_ID', raising=False)
+
+    def create(*args, **kwargs):
+        assert False, 'no call to the control server in offline mode'
+
+    monkeypatch.setattr(dci.dci_file, 'create', create)
+    cb = dci.CallbackModule()
+    cb.create_file('a task', 'content')
+
+    records = [(r, p) for _, r, p in cb._spool]
+    assert records[0][0]['type'] == 'jobstate'
+    assert records[1][0]['jobstate_id'] == records[0][0]['id']
+    assert records[1][0]['mime'] == 'application/x-ansible-output+gzip'
+    assert gzip.decompress(records[1][1]) == b'content'
+
+
+def test_upload_metrics(monkeypatch, tmpdir):
+    metrics_file = str(tmpdir.join('metrics.json'))
+    monkeypatch.setenv('DCI_METRICS_FILE', metrics_file)
+    monkeypatch.setenv('DCI_JOB_ID', 'job')
+    monkeypatch.setenv('DCI_JOBSTATE_ID', 'jobstate')
+
+    class Response(object):
+        def __init__(self, status_code):
+            self.status_code = status_code
+            self.text = 'error'
+
+    monkeypatch.setattr(dci.dci_file, 'create', lambda context, **kwargs: (
+        Response(400 if kwargs['name'] == 'bad task' else 201)))
+    cb = dci.CallbackModule()
+    cb.create_file('a task', 'content')
+    cb.create_file('bad task', 'other content')
+    cb._report_metrics()
+
+    stats = cb._metrics.calls['file']
+    assert stats['count'] == 2
+    assert stats['failures'] == 1
+    assert stats['bytes'] == len('content') + len('other content')
+    assert sum(stats['histogram']) == 2
+    assert len(cb._metrics.summary()) == 2
+    with open(metrics_file) as f:
+        assert json.load(f)['calls']['file']['count'] == 2
+
+
+def test_backlog_memory_limit(monkeypatch):
+    monkeypatch.delenv('DCI_JOB_ID', raising=False)
+    monkeypatch.setenv('DCI_BACKLOG_MEMORY_LIMIT', '10')
+    cb = dci.CallbackModule()
+    buffers = []
+    for idx in range(3):
+        buf = dci.OutputBuffer(max_size=1024)
+        buf.write('output %d' % idx)
+        buffers.append(buf)
+        cb.create_file('task %d' % idx, buf)
+
+    assert [buf.in_memory for buf in buffers] == [True, False, False]
+    assert cb._backlog_memory == len('output 0')
+
+
+def test_process_backlog_workers(monkeypatch):
+    uploaded = []
+    monkeypatch.delenv('DCI_JOB_ID', raising=False)
+    monkeypatch.delenv('DCI_JOBSTATE_ID', raising=False)
+    monkeypatch.setenv('DCI_BACKLOG_WORKERS', '4')
+
+    class Response(object):
+        status_code = 201
+
+        def json(self):
+            return {'jobstate': {'id': 'new jobstate'}}
+
+    def create(context, **kwargs):
+        uploaded.append((kwargs['name'], kwargs['content'],
+                         kwargs['job_id'], kwargs['jobstate_id']))
+        return Response()
+
+    monkeypatch.setattr(dci.dci_file, 'create', create)
+    monkeypatch.setattr(dci.dci_jobstate, 'create',
+                        lambda context, **kwargs: Response())
+    cb = dci.CallbackModule()
+    for idx in range(10):
+        buf = dci.OutputBuffer(max_size=1024)
+        buf.write('output %d' % idx)
+        cb.create_file('task %d' % idx, buf)
+    cb._job_id = 'job'
+    cb.process_backlog()
+
+    assert sorted(uploaded) == [
+        ('task %d' % idx, b'output %d' % idx, 'job', 'new jobstate')
+        for idx in range(10)]
+    assert cb._backlog == []
+
+
+def _jobstate_callback(monkeypatch, posted, uploaded):
+    monkeypatch.setenv('DCI_JOB_ID', 'job')
+    monkeypatch.delenv('DCI_JOBSTATE_ID', raising=False)
+
+    class Response(object):
+        status_code = 201
+
+        def __init__(self, jobstate_id=None):
+            self.jobstate_id = jobstate_id
+
+        def json(self):
+            return {'jobstate': {'id': self.jobstate_id}}
+
+    def create_jobstate(context, **kwargs):
+        posted.append(kwargs['status'])
+        return Response('jobstate %d' % len(posted))
+
+    def create_file(context, **kwargs):
+        uploaded.append((kwargs['name'], kwargs['jobstate_id']))
+        return Response()
+
+    monkeypatch.setattr(dci.dci_jobstate, 'create', create_jobstate)
+    monkeypatch.setattr(dci.dci_file, 'create', create_file)
+    monkeypatch.setattr(CM_default, 'v2_playbook_on_stats',
+                        lambda self, stats: None)
+    cb = dci.CallbackModule()
+    cb._explicit = False
+    return cb
+
+
+def test_jobstate_transitions(monkeypatch):
+    posted = []
+    uploaded = []
+    monkeypatch.setenv('DCI_JOBSTATE_WINDOW', '0')
+    cb = _jobstate_callback(monkeypatch, posted, uploaded)
+    cb.create_jobstate('play 1', 'pre-run')
+    cb.create_jobstate('play 2', 'running')
+    cb.create_jobstate('play 3', 'running')
+    assert posted == ['pre-run']
+
+    cb.create_file('task 1', 'content')
+    cb.create_jobstate('task 2', 'failure')
+    cb.create_jobstate('task 3', 'failure')
+    cb.create_file('task 2', 'content')
+    cb.create_file('task 3', 'content')
+    cb.create_jobstate('play 4', 'success')
+    cb.v2_playbook_on_stats(None)
+
+    assert posted == ['pre-run', 'running', 'failure', 'success']
+    assert uploaded == [('task 1', 'jobstate 2'), ('task 2', 'jobstate 3'),
+                        ('task 3', 'jobstate 3')]
+
+
+def test_jobstate_coalesce(monkeypatch):
+    posted = []
+    uploaded = []
+    cb = _jobstate_callback(monkeypatch, posted, uploaded)
+    cb.create_jobstate('play 1', 'pre-run')
+    cb.create_jobstate('play 2', 'running')
+    assert posted == []
+
+    cb.create_file('task 1', 'content')
+    cb.create_jobstate('task 2', 'post-run')
+    cb.create_jobstate('task 3', 'running')
+    assert posted == ['running']
+
+    cb.create_jobstate('task 4', 'failure')
+    cb.create_jobstate('play 5', 'success')
+    cb.v2_playbook_on_stats(None)
+
+    assert posted == ['running', 'failure', 'success']
+    assert uploaded == [('task 1', 'jobstate 1')]
+
+
+def test_request_errors(monkeypatch):
+    monkeypatch.setenv('DCI_JOB_ID', 'job')
+    monkeypatch.setenv('DCI_JOBSTATE_ID', 'jobstate')
+    errors = [ReadTimeout('read timeout'), ConnectionError('refused')]
+
+    def create(context, **kwargs):
+        raise errors.pop(0)
+
+    monkeypatch.setattr(dci.dci_file, 'create', create)
+    monkeypatch.setattr(dci.dci_jobstate, 'create', create)
+    cb = dci.CallbackModule()
+    cb._explicit = False
+    # the file may have been created: it is not retried
+    assert cb._send_file({'content': 'content'}) == ('read timeout', False)
+    cb._post_jobstate('a play', 'running')
+    assert cb._current_status is None
+    assert cb._jobstate_id == 'jobstate'
+
+
+def test_output_budget(monkeypatch):
+    uploaded = []
+    monkeypatch.setenv('DCI_TASK_OUTPUT_BUDGET', '10')
+    monkeypatch.setenv('DCI_JOB_OUTPUT_BUDGET', '18')
+    monkeypatch.setenv('DCI_JOB_ID', 'job')
+    monkeypatch.setenv('DCI_JOBSTATE_ID', 'jobstate')
+
+    class MyCallback(dci.CallbackModule):
+        def _upload_file(self, kwargs):
+            content = kwargs['content']
+            uploaded.append((kwargs['name'], content.read()
+                             if hasattr(content, 'read') else content))
+
+    cb = MyCallback()
+    for name, content in (('small', 'tiny'), ('large', 'head-' * 4 + 'tail'),
+                          ('last', 'x' * 20)):
+        buf = dci.OutputBuffer(max_size=1024)
+        buf.write(content)
+        cb.create_file(name, buf)
+    cb._upload_output_archive()
+
+    assert uploaded[0] == ('small', b'tiny')
+    assert uploaded[1][1].startswith(b'head-')
+    assert uploaded[1][1].endswith(b'tail')
+    assert b'14 bytes truncated, full output in 0000 large' in uploaded[1][1]
+    # 4 bytes left in the job budget
+    assert uploaded[2][1].startswith(b'xx\n[... 16 bytes truncated')
+    assert uploaded[3][0] == 'ansible-full-outputs.tar.gz'
+    with tarfile.open(fileobj=io.BytesIO(uploaded[3][1])) as tar:
+        assert tar.getnames() == ['0000 large', '0001 last']
+        assert tar.extractfile('0001 last').read() == b'x' * 20
+
+
+def _dedup_uploads(monkeypatch, uploaded, statuses=()):
+    statuses = list(statuses)
+
+    class Response(object):
+        text = 'error'
+
+        def __init__(self, status_code):
+            self.status_code = status_code
+
+    def create(context, **kwargs):
+        uploaded.append((kwargs['name'], kwargs['content']))
+        return Response(statuses.pop(0) if statuses else 201)
+
+    monkeypatch.setattr(dci.dci_file, 'create', create)
+
+
+def test_dedup_outputs(monkeypatch):
+    uploaded = []
+    monkeypatch.setenv('DCI_DEDUP_OUTPUTS', '1')
+    monkeypatch.setenv('DCI_DEDUP_MIN_SIZE', '8')
+    monkeypatch.setenv('DCI_JOB_ID', 'job')
+    monkeypatch.setenv('DCI_JOBSTATE_ID', 'jobstate')
+    # the first upload is rejected: its output is not a reference
+    _dedup_uploads(monkeypatch, uploaded, [400])
+
+    cb = dci.CallbackModule()
+    for name, content in (('failed', 'same output'), ('retry 1', 'same output'),
+                          ('short', 'same'), ('retry 2', 'same output'),
+                          ('short', 'same'), ('other', 'other output')):
+        cb.create_file(name, content)
+
+    assert uploaded[0] == ('failed', b'same output')
+    assert uploaded[1] == ('retry 1', b'same output')
+    assert uploaded[2] == ('short', b'same')
+    assert uploaded[3][0] == 'retry 2'
+    assert uploaded[3][1].startswith(b'[same output as "retry 1", sha256:')
+    assert uploaded[4] == ('short', b'same')
+    assert uploaded[5] == ('other', b'other output')
+
+
+def test_dedup_index(monkeypatch, tmpdir):
+    uploaded = []
+    monkeypatch.setenv('DCI_DEDUP_OUTPUTS', '1')
+    monkeypatch.setenv('DCI_DEDUP_MIN_SIZE', '0')
+    monkeypatch.setenv('DCI_DEDUP_INDEX', str(tmpdir.join('digests')))
+    monkeypatch.setenv('DCI_JOB_ID', 'job')
+    monkeypatch.setenv('DCI_JOBSTATE_ID', 'jobstate')
+    _dedup_uploads(monkeypatch, uploaded)
+
+    dci.CallbackModule().create_file('first playbook', 'content')
+    dci.CallbackModule().create_file('second playbook', 'content')
+
+    assert uploaded[0] == ('first playbook', b'content')
+    assert uploaded[1][1].startswith(b'[same output as "first playbook"')
+
+
+def test_dedup_unknown_job(monkeypatch, tmpdir):
+    uploaded = []
+    monkeypatch.setenv('DCI_DEDUP_OUTPUTS', '1')
+    monkeypatch.setenv('DCI_DEDUP_MIN_SIZE', '0')
+    monkeypatch.setenv('DCI_DEDUP_INDEX', str(tmpdir.join('digests')))
+    monkeypatch.setenv('DCI_SPOOL_DIR', str(tmpdir.join('spool')))
+    monkeypatch.delenv('DCI_JOB_ID', raising=False)
+    monkeypatch.setenv('DCI_JOBSTATE_ID', 'jobstate')
+    _dedup_uploads(monkeypatch, uploaded)
+
+    cb = dci.CallbackModule()
+    cb.create_file('task 1', 'content')
+    cb.create_file('task 2', 'content')
+    assert cb._digests == {}
+    assert not tmpdir.join('digests').exists()
+
+    cb._job_id = 'job'
+    cb.process_backlog()
+    assert uploaded == [('task 1', b'content'), ('task 2', b'content')]
+
+
+def _per_host_result(task, host):
+
+    class Named(object):
+        def __init__(self, name):
+            self.name = name
+            self._uuid = name
+
+        def get_name(self):
+            return self.name
+
+    class Result(object):
+        def __init__(self, task, host):
+            self._task = Named(task)
+            self._host = Named(host)
+
+    return Result(task, host)
+
+
+def test_output_per_host(monkeypatch):
+    uploaded = []
+    monkeypatch.setenv('DCI_OUTPUT_PER_HOST', '1')
+    monkeypatch.setenv('DCI_JOB_ID', 'job')
+    monkeypatch.setenv('DCI_JOBSTATE_ID', 'jobstate')
+    # the first upload of host2 fails and is retried before its next one
+    statuses = {'failed/TASK [second] [host2]': [503]}
+
+    class Response(object):
+        text = 'unavailable'
+
+        def __init__(self, status_code):
+            self.status_code = status_code
+
+    def create(context, **kwargs):
+        status_code = (statuses.get(kwargs['name']) or [201]).pop(0)
+        if status_code == 201:
+            uploaded.append((kwargs['name'], kwargs['content']))
+        return Response(status_code)
+
+    monkeypatch.setattr(dci.dci_file, 'create', create)
+    monkeypatch.setattr(CM_default, 'v2_playbook_on_stats',
+                        lambda self, stats: None)
+    cb = dci.CallbackModule()
+    cb.banner('TASK [first]')
+    with cb._host_capture(_per_host_result('first', 'host1')):
+        cb.display('ok: [host1] => (item=1)', color=C.COLOR_OK)
+    cb.banner('TASK [second]')
+    with cb._host_capture(_per_host_result('second', 'host2'), final=True):
+        cb.display('fatal: [host2]', color=C.COLOR_ERROR)
+    with cb._host_capture(_per_host_result('first', 'host1'), final=True):
+        cb.banner('TASK [first]')
+        cb.display('ok: [host1]', color=C.COLOR_OK)
+    cb.banner('TASK [third]')
+    with cb._host_capture(_per_host_result('third', 'host2'), final=True):
+        cb.display('ok: [host2]', color=C.COLOR_OK)
+    # no final result for this one
+    with cb._host_capture(_per_host_result('third', 'host1')):
+        cb.display('ok: [host1] => (item=1)', color=C.COLOR_OK)
+    cb.v2_playbook_on_stats(None)
+
+    assert [name for name, _ in uploaded if 'host2' in name] == [
+        'failed/TASK [second] [host2]', 'TASK [third] [host2]']
+    assert sorted(uploaded) == [
+        ('TASK [first] [host1]', b'ok: [host1] => (item=1)\nok: [host1]\n'),
+        ('TASK [third] [host1]', b'ok: [host1] => (item=1)\n'),
+        ('TASK [third] [host2]', b'ok: [host2]\n'),
+        ('failed/TASK [second] [host2]', b'fatal: [host2]\n')]
+
+
+def test_output_per_host_concurrent(monkeypatch):
+    monkeypatch.setenv('DCI_OUTPUT_PER_HOST', '1')
+    monkeypatch.setenv('DCI_JOB_ID', 'job')
+    monkeypatch.setenv('DCI_JOBSTATE_ID', 'jobstate')
+    # both uploads have to be in flight at the same time to pass it
+    barrier = threading.Barrier(2, timeout=5)
+
+    class Response(object):
+        status_code = 201
+
+    def create(context, **kwargs):
+        barrier.wait()
+        return Response()
+
+    monkeypatch.setattr(dci.dci_file, 'create', create)
+    cb = dci.CallbackModule()
+    cb.banner('TASK [first]')
+    for host in ('host1', 'host2'):
+        with cb._host_capture(_per_host_result('first', host), final=True):
+            cb.display('ok: [%s]' % host, color=C.COLOR_OK)
+    cb._drain_uploads()
+
+    assert not barrier.broken
@@ -27,7 +27,7 @@ control server
 
 %install
 mkdir -p %{buildroot}%{_datadir}/dci
-cp -r modules module_utils callback action_plugins filter_plugins %{buildroot}%{_datadir}/dci/
+cp -r modules module_utils callback action_plugins filter_plugins doc_fragments %{buildroot}%{_datadir}/dci/
 chmod 755 %{buildroot}%{_datadir}/dci
 chmod 755 %{buildroot}%{_datadir}/dci/*
 
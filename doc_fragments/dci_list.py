@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2026 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+class ModuleDocFragment(object):
+    """Options of the modules listing resources (list_argument_spec)."""
+
+    DOCUMENTATION = '''
+options:
+  page_size:
+    required: false
+    description: Number of resources fetched per call when listing
+  max_items:
+    required: false
+    description: Maximum number of resources listed
+  prefetch:
+    required: false
+    description: Number of pages fetched in parallel when listing (default 1)
+'''
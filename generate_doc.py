@@ -17,14 +17,27 @@
 '''
 Generate Markdown documentation from DCI modules.
 
-DCI Ansible modules have 2 variables: DOCUMENTATION and EXAMPLES that are triple single quoted. These variables are used to generate the documentation. They are YAML formatted. The DOCUMENTATION variable contains the module name, description, options, and other information. The EXAMPLES variable contains example usage of the module.
+DCI Ansible modules have 2 variables: DOCUMENTATION and EXAMPLES that are triple single quoted. These variables are used to generate the documentation. They are YAML formatted. The DOCUMENTATION variable contains the module name, description, options, and other information. The EXAMPLES variable contains example usage of the module. The options of the fragments listed in extends_documentation_fragment are read from the doc_fragments directory.
 '''
 
+import importlib.util
+import os
 import re
 import sys
 import yaml
 
 
+def fragment_options(name):
+    """Return the options of a documentation fragment of doc_fragments."""
+
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "doc_fragments", f"{name}.py")
+    spec = importlib.util.spec_from_file_location(name, path)
+    fragment = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(fragment)
+    return yaml.safe_load(fragment.ModuleDocFragment.DOCUMENTATION)["options"]
+
+
 def generate_markdown_docs(module_path, output_file):
     """Generate Markdown documentation from DCI modules."""
 
@@ -47,6 +60,11 @@ def generate_markdown_docs(module_path, output_file):
             f.write("| Parameter | Required | Default | Description |\n")
             f.write("| --------- | -------- | ------- | ----------- |\n")
             options = doc["options"]
+            fragments = doc.get("extends_documentation_fragment", [])
+            if isinstance(fragments, str):
+                fragments = [fragments]
+            for fragment in fragments:
+                options.update(fragment_options(fragment))
             for name in sorted(options.keys()):
                 param = options[name]
                 f.write(
@@ -14,6 +14,17 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import collections
+import inspect
+
+from concurrent.futures import ThreadPoolExecutor
+from requests.exceptions import RequestException
+
+try:
+    from ansible.module_utils.dci_etag import EtagCache
+except ImportError:
+    from module_utils.dci_etag import EtagCache
+
 
 class DciError(Exception):
     def __init__(self, rc, msg):
@@ -25,13 +36,30 @@ class DciParameterError(Exception):
         self.message = msg
 
 
+class ListResponse(object):
+    """Response of a paginated listing, made of the resources of all the
+    pages."""
+
+    status_code = 200
+
+    def __init__(self, resource_name, resources):
+        self.resource_name = resource_name
+        self.resources = resources
+
+    def json(self):
+        return {'%ss' % self.resource_name: self.resources,
+                '_meta': {'count': len(self.resources)}}
+
+
 class DciBase(object):
     """A Base DCI resource."""
 
-    def __init__(self, resource):
+    def __init__(self, resource, params=None):
         self.resource = resource
         self.resource_name = resource.__name__.split('.')[-1]
         self.deterministic_params = []
+        self.pagination = {key: (params or {}).get(key)
+                           for key in ('page_size', 'max_items', 'prefetch')}
 
     def raise_error(self, res):
         """Parse the http response and raise the appropriate error."""
@@ -58,25 +86,61 @@ class DciBase(object):
         else:
             raise DciError(res.status_code, message)
 
-    def do_delete(self, context):
-        """Remove a resource."""
+    def _cached_etag(self, context):
+        """Return the etag of the resource kept by the etag cache, None if
+        it is disabled or does not know the resource."""
+        cache = EtagCache.from_env()
+        if cache is None:
+            return None
+        return cache.get(context, self.resource_name, self.id)
+
+    def _write_with_etag(self, context, write):
+        """Call write(etag) with the cached etag of the resource, or with
+        the etag of a fresh copy if it is unknown or stale (412)."""
+        etag = self._cached_etag(context)
+        if etag is not None:
+            res = write(etag)
+            if res.status_code != 412:
+                return res
 
         res = self.resource.get(context, self.id)
         if res.status_code == 200:
+            return write(res.json()[self.resource_name].get('etag'))
+        else:
+            self.raise_error(res)
+
+    def do_delete(self, context):
+        """Remove a resource."""
+
+        def _delete(etag):
             kwargs = {}
-            if 'etag' in res.json()[self.resource_name]:
-                kwargs = {
-                    'etag': res.json()[self.resource_name]['etag']
-                }
+            if etag is not None:
+                kwargs = {'etag': etag}
             return self.resource.delete(context, self.id, **kwargs)
 
-        else:
-            self.raise_error(res)
+        res = self._write_with_etag(context, _delete)
+        if res.status_code == 204:
+            cache = EtagCache.from_env()
+            if cache is not None:
+                cache.discard(context, self.resource_name, self.id)
+        return res
+
+    def do_list(self, context, list_func=None):
+        """List all resources.
 
-    def do_list(self, context):
-        """List all resources."""
+        The resources are listed in one call unless a page size or a
+        maximum number of resources is set in pagination. list_func lists
+        the resources, see iter_list()."""
 
-        return self.resource.list(context, **self.search_criterias)
+        list_func = list_func or self.resource.list
+        page_size = self.pagination.get('page_size')
+        max_items = self.pagination.get('max_items')
+        if not page_size and not max_items:
+            return list_func(context, **self.search_criterias)
+        return ListResponse(self.resource_name, list(self.iter_list(
+            context, page_size or 100, max_items,
+            self.pagination.get('prefetch') or 1, list_func,
+            **self.search_criterias)))
 
     def do_get(self, context):
         """Retrieve a resource."""
@@ -86,12 +150,10 @@ class DciBase(object):
     def do_update(self, context):
         """Update a resource."""
 
-        res = self.resource.get(context, self.id)
-
-        if res.status_code == 200:
+        def _update(etag):
             kwargs = {
                 'id': self.id,
-                'etag': res.json()[self.resource_name]['etag']
+                'etag': etag
             }
             for param in self.deterministic_params:
                 kwargs[param] = getattr(self, param)
@@ -101,8 +163,8 @@ class DciBase(object):
                 del kwargs['active']
 
             return self.resource.update(context, **kwargs)
-        else:
-            self.raise_error(res)
+
+        return self._write_with_etag(context, _update)
 
     def do_create(self, context):
         """Create a resource."""
@@ -116,3 +178,174 @@ class DciBase(object):
             del kwargs['active']
 
         return self.resource.create(context, **kwargs)
+
+    def iter_list(self, context, page_size=100, max_items=None, prefetch=1,
+                  list_func=None, **criterias):
+        """
+        Yield the resources matching criterias, page_size at a time.
+
+        Up to prefetch pages are fetched in parallel while the resources
+        of the current one are consumed, and the listing stops after
+        max_items resources. The resources are sorted by creation date
+        unless another sort is given, so new resources do not shift the
+        pages. list_func(context, **kwargs) lists the resources, the list
+        function of the resource by default.
+        """
+
+        list_func = list_func or self.resource.list
+        key = '%ss' % self.resource_name
+        if not criterias.get('sort'):
+            criterias['sort'] = 'created_at'
+
+        def _page(offset):
+            res = list_func(context, limit=page_size, offset=offset,
+                            **criterias)
+            if res.status_code != 200:
+                self.raise_error(res)
+            return res.json()
+
+        page = _page(0)
+        total = page['_meta']['count']
+        if max_items is not None:
+            total = min(total, max_items)
+        offsets = iter(range(page_size, total, page_size))
+        pending = collections.deque()
+        count = 0
+        with ThreadPoolExecutor(max_workers=max(1, prefetch)) as executor:
+            while True:
+                for offset in offsets:
+                    pending.append(executor.submit(_page, offset))
+                    if len(pending) >= prefetch:
+                        break
+                for resource in page[key]:
+                    if count >= total:
+                        return
+                    count += 1
+                    yield resource
+                if not pending or len(page[key]) < page_size:
+                    return
+                page = pending.popleft().result()
+
+    def list_all(self, context, where=None, page_size=100):
+        """List all the resources matching where, page_size at a time."""
+
+        return list(self.iter_list(context, page_size, where=where))
+
+    @staticmethod
+    def _desired_fields(item):
+        """Return the fields of a desired resource as sent to the API."""
+
+        fields = dict(item)
+        fields.pop('state', None)
+        if 'active' in fields:
+            fields['state'] = 'active' if fields.pop('active') else \
+                'inactive'
+        return fields
+
+    @staticmethod
+    def _differs(existing, fields):
+        """Whether an existing resource has to be updated. The fields not
+        returned by the API, like the passwords, are not compared."""
+
+        return any(field in existing and existing[field] != value
+                   for field, value in fields.items())
+
+    def _unsupported(self, action, fields):
+        """Return why the dciclient function of action does not accept the
+        fields, None if it does."""
+
+        func = self.resource.create if action == 'created' else \
+            self.resource.update
+        try:
+            inspect.signature(func).bind(None, **fields)
+        except TypeError as exc:
+            return str(exc)
+
+    def _apply(self, context, action, fields):
+        if action == 'created':
+            res = self.resource.create(context, **fields)
+        elif action == 'updated':
+            res = self.resource.update(context, **fields)
+        else:
+            res = self.resource.delete(context, fields['id'],
+                                       etag=fields['etag'])
+        if res.status_code not in (200, 201, 204):
+            self.raise_error(res)
+        return res
+
+    def reconcile(self, context, items, key='name', purge=False, where=None,
+                  workers=4, page_size=100, check_mode=False,
+                  purge_all=False):
+        """
+        Make the resources match items, the list of the desired resources.
+
+        The current resources, matching where, are listed page_size at a
+        time and matched with the items by their key field. The missing
+        resources are created, the different ones updated and the ones
+        with state absent deleted, as well as the ones not in items if
+        purge is set. Without where, purge_all must also be set to delete
+        all the resources not in items. The changes are applied by workers
+        threads.
+
+        Return the keys of the resources created, updated and deleted, and
+        the errors of the changes which failed.
+        """
+
+        if purge and where is None and not purge_all:
+            raise DciParameterError('purge without where deletes all the %ss '
+                                    'not listed, set purge_all to confirm' %
+                                    self.resource_name)
+        current = {}
+        for resource in self.list_all(context, where, page_size):
+            current[resource.get(key)] = resource
+
+        result = {'created': [], 'updated': [], 'deleted': [], 'failed': []}
+        changes = []
+        desired = set()
+        for item in items:
+            if item.get(key) is None:
+                raise DciParameterError('%s must be specified for each %s' %
+                                        (key, self.resource_name))
+            desired.add(item[key])
+            existing = current.get(item[key])
+            fields = self._desired_fields(item)
+            if item.get('state', 'present') == 'absent':
+                if existing is not None:
+                    changes.append(('deleted', existing))
+            elif existing is None:
+                changes.append(('created', fields))
+            elif self._differs(existing, fields):
+                changes.append(('updated', dict(fields, id=existing['id'],
+                                                etag=existing['etag'])))
+        if purge:
+            changes.extend(('deleted', existing)
+                           for name, existing in current.items()
+                           if name not in desired)
+
+        for action, fields in list(changes):
+            error = action != 'deleted' and self._unsupported(action, fields)
+            if error:
+                changes.remove((action, fields))
+                result['failed'].append({key: fields[key], 'msg': error})
+
+        if check_mode:
+            for action, fields in changes:
+                result[action].append(fields[key])
+            return result
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = [(action, fields, executor.submit(self._apply, context,
+                                                        action, fields))
+                       for action, fields in changes]
+            for action, fields, future in futures:
+                try:
+                    future.result()
+                except DciError as exc:
+                    result['failed'].append({key: fields[key],
+                                             'msg': exc.message})
+                except RequestException as exc:
+                    result['failed'].append({key: fields[key],
+                                             'msg': str(exc)})
+                else:
+                    result[action].append(fields[key])
+        return result
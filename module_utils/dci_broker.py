@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2026 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''
+Local broker keeping warm connections to the DCI control server.
+
+Each dci_* module runs in a new process which has to open its own
+connection, with a TLS handshake, to the control server. The broker is a
+long-lived process listening on a unix socket, holding a pool of
+keep-alive connections and the credentials of its environment, to which
+the modules forward their requests:
+
+    python3 dci_broker.py [--socket <path>] [--idle-timeout <seconds>] &
+
+The modules do not send their credentials to the broker: it signs the
+requests itself, and only forwards those of modules using the same
+credentials to the same control server. The socket is only used in a
+directory of the user not accessible by the other users, and both ends
+check that the other one runs as the same user. When the broker is not
+enabled or not running, the modules connect to the control server
+themselves. The settings are read from the environment:
+
+  DCI_BROKER           forward the requests to the broker when it runs
+                       (false)
+  DCI_BROKER_SOCKET    socket of the broker ($XDG_RUNTIME_DIR/dci-broker.sock
+                       or <tmpdir>/dci-broker-<uid>/broker.sock)
+'''
+
+import argparse
+import json
+import os
+import socket
+import socketserver
+import stat
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.exceptions import ConnectionError, Timeout
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+try:
+    from ansible.module_utils.dci_env import env_bool
+except ImportError:
+    # controller side plugins and command line
+    if __name__ == '__main__':
+        sys.path.append(os.path.dirname(os.path.dirname(
+            os.path.realpath(__file__))))
+    from module_utils.dci_env import env_bool
+
+# headers carrying the credentials of the modules, not sent to the broker
+AUTH_HEADERS = ('authorization', 'x-dci-date')
+
+
+class BrokerError(Exception):
+    def __init__(self, msg):
+        super(BrokerError, self).__init__(msg)
+        self.message = msg
+
+
+def default_socket_path():
+    path = os.getenv('DCI_BROKER_SOCKET')
+    if path:
+        return path
+    if os.getenv('XDG_RUNTIME_DIR'):
+        return os.path.join(os.getenv('XDG_RUNTIME_DIR'), 'dci-broker.sock')
+    return os.path.join(tempfile.gettempdir(), 'dci-broker-%d' % os.getuid(),
+                        'broker.sock')
+
+
+def is_private_dir(path):
+    """Whether path is a directory of the user that the other users can
+    not access."""
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return (stat.S_ISDIR(st.st_mode) and st.st_uid == os.getuid() and
+            not st.st_mode & 0o077)
+
+
+def is_private_socket(path):
+    """Whether path is a socket of the user in a private directory."""
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return (stat.S_ISSOCK(st.st_mode) and st.st_uid == os.getuid() and
+            is_private_dir(os.path.dirname(os.path.abspath(path))))
+
+
+def peer_uid(sock):
+    """Return the user id of the process at the other end of a unix
+    socket, None when the platform does not tell."""
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                            struct.calcsize('3i'))
+    return struct.unpack('3i', creds)[1]
+
+
+def _send_message(sock, header, body=b''):
+    """Send a JSON header on one line followed by body."""
+    header = dict(header, size=len(body))
+    sock.sendall(json.dumps(header).encode('UTF-8') + b'\n' + body)
+
+
+def _recv_message(rfile):
+    """Return the (header, body) read from the file of a socket."""
+    line = rfile.readline()
+    if not line.endswith(b'\n'):
+        raise ConnectionError('connection to the DCI broker closed')
+    header = json.loads(line.decode('UTF-8'))
+    body = rfile.read(header['size'])
+    if len(body) < header['size']:
+        raise ConnectionError('connection to the DCI broker closed')
+    return header, body
+
+
+class BrokerAdapter(BaseAdapter):
+    """Transport adapter forwarding the requests of a requests.Session to
+    the broker, or to fallback when the broker is not running, does not
+    serve these credentials or the body of the request is streamed."""
+
+    def __init__(self, path, fallback, identity):
+        super(BrokerAdapter, self).__init__()
+        self.path = path
+        self.fallback = fallback
+        self.identity = identity
+
+    def send(self, request, stream=False, timeout=None, verify=True,
+             cert=None, proxies=None):
+        body = request.body
+        if isinstance(body, str):
+            body = body.encode('UTF-8')
+        sock = None
+        if not proxies and (body is None or isinstance(body, bytes)):
+            sock = self._connect()
+        if sock is None:
+            return self.fallback.send(request, stream, timeout, verify,
+                                      cert, proxies)
+        if isinstance(timeout, (int, float)):
+            timeout = (timeout, timeout)
+        headers = dict((k, v) for k, v in request.headers.items()
+                       if k.lower() not in AUTH_HEADERS)
+        try:
+            _send_message(sock, {'identity': self.identity,
+                                 'method': request.method,
+                                 'url': request.url,
+                                 'headers': headers,
+                                 'timeout': timeout,
+                                 'verify': verify,
+                                 'cert': cert}, body or b'')
+            with sock.makefile('rb') as rfile:
+                header, content = _recv_message(rfile)
+        except (IOError, OSError) as exc:
+            raise ConnectionError(exc, request=request)
+        finally:
+            sock.close()
+
+        if header.get('error') == 'unauthorized':
+            # other credentials or control server than the broker
+            return self.fallback.send(request, stream, timeout, verify,
+                                      cert, proxies)
+        if 'error' in header:
+            error = Timeout if header['error'] == 'timeout' else \
+                ConnectionError
+            raise error(header['message'], request=request)
+        return self.build_response(request, header, content)
+
+    def _connect(self):
+        """Return a socket connected to the broker, None if it does not
+        run or runs as another user."""
+        if not is_private_socket(self.path):
+            return None
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+            if peer_uid(sock) in (None, os.getuid()):
+                return sock
+        except (IOError, OSError):
+            pass
+        sock.close()
+        return None
+
+    @staticmethod
+    def build_response(request, header, content):
+        response = requests.Response()
+        response.status_code = header['status_code']
+        response.reason = header['reason']
+        response.headers = CaseInsensitiveDict(header['headers'])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = request.url
+        response.request = request
+        response._content = content
+        return response
+
+    def close(self):
+        self.fallback.close()
+
+
+def attach(session, identity):
+    """Forward the requests of a requests.Session made with the credentials
+    of identity, see dci_session.credentials_identity(), to the broker if
+    it is enabled, keeping its adapters as fallback."""
+    if not env_bool('DCI_BROKER'):
+        return session
+    path = default_socket_path()
+    if not is_private_socket(path):
+        return session
+    for prefix in ('http://', 'https://'):
+        adapter = session.get_adapter(prefix)
+        if not isinstance(adapter, BrokerAdapter):
+            session.mount(prefix, BrokerAdapter(path, adapter,
+                                                list(identity)))
+    return session
+
+
+class BrokerHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        if peer_uid(self.connection) not in (None, os.getuid()):
+            return
+        self.server.touch()
+        try:
+            header, body = _recv_message(self.rfile)
+        except (ConnectionError, ValueError):
+            return
+        if not self.server.serves(header):
+            _send_message(self.connection, {'error': 'unauthorized'})
+            return
+        try:
+            response = self.server.forward(header, body)
+        except Timeout as exc:
+            _send_message(self.connection, {'error': 'timeout',
+                                            'message': str(exc)})
+        except requests.RequestException as exc:
+            _send_message(self.connection, {'error': 'connection',
+                                            'message': str(exc)})
+        else:
+            # the content is sent decoded
+            headers = dict((k, v) for k, v in response.headers.items()
+                           if k.lower() not in ('content-encoding',
+                                                'content-length',
+                                                'transfer-encoding'))
+            _send_message(self.connection,
+                          {'status_code': response.status_code,
+                           'reason': response.reason,
+                           'headers': headers},
+                          response.content)
+        self.server.touch()
+
+
+class BrokerServer(socketserver.ThreadingMixIn,
+                   socketserver.UnixStreamServer):
+    """Unix socket server signing the requests it receives with the
+    credentials of context and sending them with its pool of keep-alive
+    connections."""
+
+    daemon_threads = True
+
+    def __init__(self, path, context, identity, idle_timeout=0):
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(directory):
+            os.makedirs(directory, 0o700)
+        if not is_private_dir(directory):
+            raise BrokerError('%s must be a directory of the user that the '
+                              'other users can not access' % directory)
+        if os.path.lexists(path):
+            os.unlink(path)
+        # only the user running the broker can connect to it
+        umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.__init__(self, path, BrokerHandler)
+        finally:
+            os.umask(umask)
+        self.path = path
+        self.context = context
+        self.identity = list(identity)
+        self.idle_timeout = idle_timeout
+        self.last_activity = time.time()
+
+    def touch(self):
+        self.last_activity = time.time()
+
+    def serves(self, header):
+        """Whether the request of header comes from a module using the
+        credentials of the broker, to its control server."""
+        return (header.get('identity') == self.identity and
+                header.get('url', '').startswith(
+                    self.context.dci_cs_api + '/'))
+
+    def forward(self, header, body):
+        session = self.context.session
+        request = session.prepare_request(requests.Request(
+            header['method'], header['url'], headers=header['headers'],
+            data=body or None))
+        timeout = header.get('timeout')
+        # sent by the adapters of the session: the retries and the rate
+        # limit are applied by the modules
+        return session.send(request, timeout=tuple(timeout)
+                            if timeout else None,
+                            verify=header.get('verify', True),
+                            cert=header.get('cert'),
+                            allow_redirects=False)
+
+    def service_actions(self):
+        if (self.idle_timeout and
+                time.time() - self.last_activity > self.idle_timeout):
+            # called from serve_forever(), shutdown() would wait for it
+            threading.Thread(target=self.shutdown).start()
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        self.context.session.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def main(args=sys.argv[1:]):
+    from module_utils.dci_session import build_context, credentials_identity
+
+    parser = argparse.ArgumentParser(
+        description='Keep warm connections to the DCI control server for '
+        'the dci modules')
+    parser.add_argument('--socket', default=default_socket_path(),
+                        help='path of the unix socket')
+    parser.add_argument('--idle-timeout', type=float, default=0,
+                        help='exit after this number of seconds without '
+                        'request, 0 to run forever')
+    options = parser.parse_args(args)
+
+    credentials = (os.getenv('DCI_CS_URL', 'https://api.distributed-ci.io'),
+                   os.getenv('DCI_LOGIN'), os.getenv('DCI_PASSWORD'),
+                   os.getenv('DCI_CLIENT_ID'), os.getenv('DCI_API_SECRET'))
+    context = build_context(*credentials)
+    if context is None:
+        sys.stderr.write('Missing or incomplete credentials.\n')
+        return 1
+    try:
+        server = BrokerServer(options.socket, context,
+                              credentials_identity(*credentials),
+                              options.idle_timeout)
+    except (BrokerError, IOError, OSError) as exc:
+        sys.stderr.write('%s\n' % exc)
+        return 1
+    try:
+        server.serve_forever(poll_interval=1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
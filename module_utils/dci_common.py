@@ -16,7 +16,10 @@
 
 from ansible.module_utils.basic import env_fallback
 from ansible.module_utils.dci_base import DciError, DciParameterError
-from dciclient.v1.api import context as dci_context
+from ansible.module_utils.dci_broker import attach as attach_broker
+from ansible.module_utils.dci_etag import EtagCache, SCOPE_FIELDS
+from ansible.module_utils.dci_retry import CircuitOpenError
+from ansible.module_utils.dci_session import credentials_identity, get_context
 from ansible.release import __version__ as ansible_version
 from dciclient.version import __version__ as dciclient_version
 from dciauth.version import __version__ as dciauth_version
@@ -38,25 +41,28 @@ def authentication_argument_spec():
     )
 
 
+def list_argument_spec():
+    return dict(
+        page_size=dict(required=False, type='int'),
+        max_items=dict(required=False, type='int'),
+        prefetch=dict(required=False, type='int'),
+    )
+
+
 def build_dci_context(module):
     user_agent = ('Ansible/%s (python-dciclient/%s, python-dciauth/%s)'
                   ) % (ansible_version, dciclient_version, dciauth_version)
-    if module.params['dci_login'] and module.params['dci_password']:
-        return dci_context.build_dci_context(
-            module.params['dci_cs_url'],
-            module.params['dci_login'],
-            module.params['dci_password'],
-            user_agent
-        )
-    elif module.params['dci_client_id'] and module.params['dci_api_secret']:
-        return dci_context.build_signature_context(
-            module.params['dci_cs_url'],
-            module.params['dci_client_id'],
-            module.params['dci_api_secret'],
-            user_agent
-        )
-    else:
+    credentials = (module.params['dci_cs_url'],
+                   module.params['dci_login'],
+                   module.params['dci_password'],
+                   module.params['dci_client_id'],
+                   module.params['dci_api_secret'])
+    context = get_context(*credentials, user_agent=user_agent)
+    if context is None:
         module.fail_json(msg='Missing or incomplete credentials.')
+    # short-lived process: reuse the connections of the broker if it runs
+    attach_broker(context.session, credentials_identity(*credentials))
+    return context
 
 
 def module_params_empty(module_params):
@@ -78,7 +84,7 @@ def run_action_func(action_func, context, module):
 
     try:
         res = action_func(context)
-    except (DciError, DciParameterError) as exc:
+    except (DciError, DciParameterError, CircuitOpenError) as exc:
         module.fail_json(msg=exc.message)
 
     return res
@@ -103,11 +109,15 @@ def get_standard_action(params):
         "dci_api_secret",
         "embed",
         "mime",
+        "compression",
         "state",
         "where",
         "query",
         "active",
         "has_pre_release_access",
+        "page_size",
+        "max_items",
+        "prefetch",
     ]
     deterministic_params = {k: v for k, v in params.items()
                             if k not in non_determistic_params}
@@ -135,6 +145,24 @@ def get_standard_action(params):
     return 'create'
 
 
+def _cached_resource(context, resource_name, params):
+    """Return the id and the name of the existing resource of params from
+    the etag cache, None if it is not cached."""
+    cache = EtagCache.from_env()
+    if cache is None:
+        return None
+    if params['name'] is not None:
+        scope = dict((field, params[field]) for field in SCOPE_FIELDS
+                     if params.get(field) is not None)
+        cached = cache.find(context, resource_name, params['name'], scope)
+    else:
+        cached = cache.resource(context, resource_name, params['id'])
+    if cached is None:
+        return None
+    return dict((field, cached[field]) for field in ('id', 'name')
+                if field in cached)
+
+
 def parse_http_response(response, resource, context, module):
     """
     Properly parse the HTTP response.
@@ -166,14 +194,23 @@ def parse_http_response(response, resource, context, module):
     elif response.status_code == 204:
         result = {}
         if module.params['state'] != 'absent':
-            result = {
-                '%s' % resource_name: resource.get(
+            if EtagCache.cached_results():
+                # the etag changed with the update, only the id is known
+                resource_data = {'id': module.params['id']}
+            else:
+                resource_data = resource.get(
                     context, module.params['id']
                 ).json()[resource_name]
-            }
+            result = {'%s' % resource_name: resource_data}
         result['changed'] = True
 
     elif response.status_code == 409:
+        cached = None
+        if EtagCache.cached_results():
+            cached = _cached_resource(context, resource_name, module.params)
+        if cached is not None:
+            # already known by the cache, nothing new to remember
+            return {'%s' % resource_name: cached, 'changed': False}
         if module.params['name'] is not None:
             result = {
                 '%s' % resource_name: resource.list(
@@ -193,4 +230,9 @@ def parse_http_response(response, resource, context, module):
             result['status_code'] = response.status_code
         result['changed'] = True
 
+    # resources and etags used by the next calls of the modules
+    cache = EtagCache.from_env()
+    if cache is not None:
+        cache.remember(context, resource_name, result)
+
     return result
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2026 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''
+Compression of the files uploaded to the DCI control server.
+
+The compressed files keep their mime type with the compression as a
+structured syntax suffix (RFC 6839), like application/junit+gzip, so the
+control server can decompress them when they are served.
+'''
+
+import gzip
+import shutil
+import tempfile
+
+try:
+    import zstandard
+except ImportError:
+    zstandard_found = False
+else:
+    zstandard_found = True
+
+COMPRESSIONS = ('gzip', 'zstd')
+
+# size above which a compressed stream is stored in a temporary file
+SPOOL_SIZE = 8 * 1024 * 1024
+
+
+class CompressionError(Exception):
+    def __init__(self, msg):
+        super(CompressionError, self).__init__(msg)
+        self.message = msg
+
+
+def check_compression(compression):
+    if compression not in COMPRESSIONS:
+        raise CompressionError('unknown compression %s, expected one of %s'
+                               % (compression, ', '.join(COMPRESSIONS)))
+    if compression == 'zstd' and not zstandard_found:
+        raise CompressionError('The python zstandard module is required for '
+                               'the zstd compression')
+
+
+def compressed_mime(mime, compression):
+    return '%s+%s' % (mime, compression)
+
+
+def compress(content, compression):
+    """Compress content, bytes or a file object.
+
+    Bytes are returned for bytes. For a file object, the content is
+    compressed by chunks into a temporary file which is returned rewound."""
+    check_compression(compression)
+    if not hasattr(content, 'read'):
+        if compression == 'gzip':
+            return gzip.compress(content)
+        return zstandard.ZstdCompressor().compress(content)
+
+    output = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    if compression == 'gzip':
+        with gzip.GzipFile(fileobj=output, mode='wb') as gz:
+            shutil.copyfileobj(content, gz)
+    else:
+        zstandard.ZstdCompressor().copy_stream(content, output)
+    output.seek(0)
+    return output
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2026 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''
+Settings read from the environment by the modules, the module_utils and
+the callbacks.
+'''
+
+import os
+
+TRUE_VALUES = ('1', 'true', 'yes', 'on')
+FALSE_VALUES = ('0', 'false', 'no', 'off')
+
+
+def env_number(name, default, cast=int):
+    """Return the environment variable name converted by cast, default if
+    it is not set or not a number."""
+    try:
+        return cast(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def env_bool(name, default=False):
+    """Return the environment variable name as a boolean, default if it is
+    not set or not a boolean."""
+    value = os.getenv(name, '').strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    return default
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2026 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''
+Cache of the resources of the DCI control server returned by the modules.
+
+The updates and the deletions of a resource need its etag. Without the
+cache, the modules get the resource before each of them. With the cache,
+the etags returned by the previous calls of the modules are used, and the
+resource is only fetched again when the server rejects a stale etag with
+a 412. Only the id, the etag, the name and the team, product or topic of
+the resources are kept, never their other fields which can hold secrets.
+With DCI_CACHED_RESULTS, the modules return only the id of a resource
+after an update answered with no content (204), and only its id and name
+when it already exists (409) and is in the cache, instead of getting it.
+
+The cache is a small JSON file locked with flock(2), shared by the
+modules running on a host. The settings are read from the environment:
+
+  DCI_ETAG_CACHE        file of the cache, unset to disable it
+  DCI_ETAG_CACHE_SIZE   number of resources kept in the cache (1000)
+  DCI_CACHED_RESULTS    return only the id (and name) of the updated and
+                        existing resources (false)
+'''
+
+import fcntl
+import json
+import os
+
+try:
+    from ansible.module_utils.dci_env import env_bool, env_number
+except ImportError:
+    # controller side plugins
+    from module_utils.dci_env import env_bool, env_number
+
+
+# the fields scoping the name of a resource
+SCOPE_FIELDS = ('team_id', 'product_id', 'topic_id')
+# the fields of the resources kept by the cache
+CACHED_FIELDS = ('id', 'etag', 'name') + SCOPE_FIELDS
+
+
+class EtagCache(object):
+    """Etags of the resources keyed by API URL, resource type and id."""
+
+    def __init__(self, path, size=1000):
+        self.path = path
+        self.size = max(1, size)
+
+    @classmethod
+    def from_env(cls):
+        """Return the cache configured by the environment, None if it is
+        disabled."""
+        path = os.getenv('DCI_ETAG_CACHE')
+        if not path:
+            return None
+        return cls(path, env_number('DCI_ETAG_CACHE_SIZE', 1000))
+
+    @staticmethod
+    def cached_results():
+        """Whether the modules return only the id of an updated resource,
+        and the id and name of an existing one, instead of getting it."""
+        return env_bool('DCI_CACHED_RESULTS')
+
+    @staticmethod
+    def _key(context, resource_name, resource_id):
+        return '%s/%ss/%s' % (context.dci_cs_api, resource_name, resource_id)
+
+    def _update(self, func):
+        """Apply func to the resources of the file under an exclusive lock
+        and return its result."""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        with os.fdopen(fd, 'r+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                resources = json.load(f)
+                if not isinstance(resources, dict):
+                    resources = {}
+            except ValueError:
+                resources = {}
+            changed = dict(resources)
+            result = func(changed)
+            if changed != resources or list(changed) != list(resources):
+                # the most recently set resources are the last ones
+                for key in list(changed)[:-self.size]:
+                    del changed[key]
+                f.seek(0)
+                f.truncate()
+                json.dump(changed, f)
+        return result
+
+    def resource(self, context, resource_name, resource_id):
+        """Return the cached resource, None if it is unknown."""
+        key = self._key(context, resource_name, resource_id)
+        try:
+            resource = self._update(lambda resources: resources.get(key))
+        except (IOError, OSError):
+            return None
+        return resource if isinstance(resource, dict) else None
+
+    def find(self, context, resource_name, name, scope):
+        """Return the most recently cached resource named name whose
+        SCOPE_FIELDS match the scope dict, None if it is unknown."""
+        prefix = self._key(context, resource_name, '')
+
+        def _find(resources):
+            for key, resource in reversed(list(resources.items())):
+                if (key.startswith(prefix) and isinstance(resource, dict) and
+                        resource.get('name') == name and
+                        all(resource.get(field) == value
+                            for field, value in scope.items())):
+                    return resource
+
+        try:
+            return self._update(_find)
+        except (IOError, OSError):
+            return None
+
+    def get(self, context, resource_name, resource_id):
+        """Return the cached etag of a resource, None if it is unknown."""
+        resource = self.resource(context, resource_name, resource_id)
+        return resource.get('etag') if resource else None
+
+    def remember(self, context, resource_name, result):
+        """Cache the resources of a module result."""
+        resources = result.get(resource_name)
+        resources = [resources] if isinstance(resources, dict) else \
+            result.get('%ss' % resource_name) or []
+        new = {}
+        for resource in resources:
+            if isinstance(resource, dict) and resource.get('id'):
+                new[self._key(context, resource_name, resource['id'])] = \
+                    dict((field, resource[field]) for field in CACHED_FIELDS
+                         if field in resource)
+        if not new:
+            return
+
+        def _set(resources):
+            for key, resource in new.items():
+                resources.pop(key, None)
+                resources[key] = resource
+
+        try:
+            self._update(_set)
+        except (IOError, OSError):
+            pass
+
+    def discard(self, context, resource_name, resource_id):
+        """Remove a deleted resource."""
+        key = self._key(context, resource_name, resource_id)
+        try:
+            self._update(lambda resources: resources.pop(key, None))
+        except (IOError, OSError):
+            pass
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2026 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''
+Rate limiter for the writes to the DCI control server.
+
+A token bucket whose state is kept in a local file locked with flock(2),
+so all the playbooks, modules and callbacks running on a host share the
+same budget of requests. The settings are read from the environment:
+
+  DCI_RATE_LIMIT        write requests per second, 0 to disable (0)
+  DCI_RATE_BURST        requests allowed at once after an idle time
+                        (DCI_RATE_LIMIT)
+  DCI_RATE_LIMIT_FILE   state file shared by the processes
+                        (<tmpdir>/dci-ratelimit-<uid>)
+'''
+
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+
+try:
+    from ansible.module_utils.dci_env import env_number
+except ImportError:
+    # controller side plugins
+    from module_utils.dci_env import env_number
+
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+
+class RateLimiter(object):
+    """Token bucket refilled with rate tokens per second, up to burst."""
+
+    def __init__(self, rate, burst=None, path=None):
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst or rate))
+        self.path = path
+        self._lock = threading.Lock()
+        self._state = {'tokens': self.burst, 'time': time.time()}
+
+    @classmethod
+    def from_env(cls):
+        """Return the limiter configured by the environment, None if the
+        rate is not limited."""
+        rate = env_number('DCI_RATE_LIMIT', 0, float)
+        if rate <= 0:
+            return None
+        path = os.getenv('DCI_RATE_LIMIT_FILE', os.path.join(
+            tempfile.gettempdir(), 'dci-ratelimit-%d' % os.getuid()))
+        return cls(rate, env_number('DCI_RATE_BURST', rate, float), path)
+
+    def _take(self, state):
+        """Refill the bucket of state and take a token. Return the time to
+        wait before a token is available, 0 if one was taken."""
+        now = time.time()
+        tokens = min(self.burst, state['tokens'] +
+                     max(0, now - state['time']) * self.rate)
+        state['time'] = now
+        if tokens >= 1:
+            state['tokens'] = tokens - 1
+            return 0
+        state['tokens'] = tokens
+        return (1 - tokens) / self.rate
+
+    def _take_shared(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                state = json.loads(os.read(fd, 4096).decode('UTF-8'))
+                state = {'tokens': float(state['tokens']),
+                         'time': float(state['time'])}
+            except (ValueError, KeyError, TypeError):
+                state = {'tokens': self.burst, 'time': time.time()}
+            wait = self._take(state)
+            data = json.dumps(state).encode('UTF-8')
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, data)
+            return wait
+        finally:
+            os.close(fd)
+
+    def acquire(self):
+        """Wait for a token."""
+        while True:
+            with self._lock:
+                try:
+                    wait = self._take_shared() if self.path else None
+                except (IOError, OSError):
+                    # unusable state file: limit this process only
+                    wait = None
+                if wait is None:
+                    wait = self._take(self._state)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def install(self, session):
+        """Take a token before each write request of a requests.Session."""
+        request = session.request
+
+        def _request(method, url, *args, **kwargs):
+            if method.upper() in WRITE_METHODS:
+                self.acquire()
+            return request(method, url, *args, **kwargs)
+
+        session.request = _request
+        return session
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2026 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''
+Retry layer for the calls to the DCI control server.
+
+The policy is installed on the HTTP session of a dciclient context by
+dci_session.configure_session() so every API call made with this context
+is retried with a jittered exponential backoff. The idempotent requests are
+retried on connection errors, timeouts, 429 and 5xx responses. The other
+ones, like the creations, only when they did not reach the control server:
+on errors to connect, 429 and 503 responses. No attempt starts once
+DCI_RETRY_DEADLINE seconds have elapsed since the first one. After too many
+consecutive failures, a circuit breaker fails the calls immediately for a
+while instead of waiting for a control server which is down.
+
+The settings are read from the environment:
+
+  DCI_RETRY_ATTEMPTS               attempts per call (5)
+  DCI_RETRY_BACKOFF                base delay between attempts (1 second)
+  DCI_RETRY_MAX_BACKOFF            maximum delay between attempts (30 seconds)
+  DCI_RETRY_DEADLINE               seconds after which a call is not retried,
+                                   0 for no limit (120)
+  DCI_CIRCUIT_BREAKER_THRESHOLD    failed calls opening the circuit (10)
+  DCI_CIRCUIT_BREAKER_TIMEOUT      seconds before trying again (60)
+'''
+
+import random
+import threading
+import time
+
+from requests.exceptions import ConnectionError, ConnectTimeout, Timeout
+from urllib3.exceptions import NewConnectionError
+
+try:
+    from ansible.module_utils.dci_env import env_number
+except ImportError:
+    # controller side plugins
+    from module_utils.dci_env import env_number
+
+
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+# the control server did not process the request
+UNPROCESSED_STATUSES = (429, 503)
+
+
+def is_connect_error(exc):
+    """Whether the request failed before being sent to the server."""
+    if isinstance(exc, ConnectTimeout):
+        return True
+    reason = getattr(exc.args[0] if exc.args else None, 'reason', None)
+    return isinstance(reason, NewConnectionError)
+
+
+class CircuitOpenError(ConnectionError):
+    def __init__(self, msg):
+        super(CircuitOpenError, self).__init__(msg)
+        self.message = msg
+
+
+class CircuitBreaker(object):
+    """Count the consecutive failed calls and reject the calls for
+    reset_timeout seconds once threshold is reached."""
+
+    def __init__(self, threshold=10, reset_timeout=60):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            # half-open: let one call go through to probe the server
+            if time.time() - self.opened_at >= self.reset_timeout:
+                self.opened_at = time.time()
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.threshold and self.failures >= self.threshold:
+                self.opened_at = time.time()
+
+
+class RetryPolicy(object):
+    """Call a function returning an HTTP response until it succeeds or the
+    attempts are exhausted."""
+
+    def __init__(self, attempts=5, backoff=1.0, max_backoff=30.0,
+                 breaker=None, deadline=120):
+        self.attempts = max(1, attempts)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+        self.breaker = breaker or CircuitBreaker()
+        # total number of retries done by the policy
+        self.retries = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            attempts=env_number('DCI_RETRY_ATTEMPTS', 5),
+            backoff=env_number('DCI_RETRY_BACKOFF', 1.0, float),
+            max_backoff=env_number('DCI_RETRY_MAX_BACKOFF', 30.0, float),
+            breaker=CircuitBreaker(
+                env_number('DCI_CIRCUIT_BREAKER_THRESHOLD', 10),
+                env_number('DCI_CIRCUIT_BREAKER_TIMEOUT', 60, float)),
+            deadline=env_number('DCI_RETRY_DEADLINE', 120, float))
+
+    @staticmethod
+    def is_transient(response):
+        # 429: rate limited by the control server
+        return response.status_code >= 500 or response.status_code == 429
+
+    def delay(self, attempt):
+        """Full jitter exponential backoff."""
+        return random.uniform(
+            0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def call(self, func, *args, idempotent=True, **kwargs):
+        """Call func(*args, **kwargs) until it returns a response which is
+        not transient. A call which is not idempotent is only retried when
+        the control server did not process it."""
+        if not self.breaker.allow():
+            raise CircuitOpenError(
+                'the DCI control server failed %d times in a row, not '
+                'retrying before %s seconds' % (self.breaker.failures,
+                                                self.breaker.reset_timeout))
+        start = time.time()
+        for attempt in range(self.attempts):
+            error = response = None
+            try:
+                response = func(*args, **kwargs)
+            except (ConnectionError, Timeout) as exc:
+                error = exc
+                retry = idempotent or is_connect_error(exc)
+            else:
+                if not self.is_transient(response):
+                    self.breaker.success()
+                    return response
+                retry = (idempotent or
+                         response.status_code in UNPROCESSED_STATUSES)
+            delay = self.delay(attempt)
+            if (not retry or attempt == self.attempts - 1 or
+                    (self.deadline and
+                     time.time() + delay - start > self.deadline)):
+                self.breaker.failure()
+                if error is not None:
+                    raise error
+                return response
+            # rewind the file objects consumed by the failed attempt
+            data = kwargs.get('data')
+            if hasattr(data, 'seek'):
+                data.seek(0)
+            self.retries += 1
+            time.sleep(delay)
+
+    def install(self, session):
+        """Route all the requests of a requests.Session through the policy.
+
+        The adapters of the session should not retry on their own, see
+        dci_session.configure_session()."""
+        request = session.request
+
+        def _request(method, url, *args, **kwargs):
+            return self.call(request, method, url, *args,
+                             idempotent=method.upper() in IDEMPOTENT_METHODS,
+                             **kwargs)
+
+        session.request = _request
+        # exposed for the callers counting the retries of their calls
+        session.retry_policy = self
+        return session
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2026 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''
+HTTP sessions to the DCI control server.
+
+The dciclient contexts are built with a pool of keep-alive connections so
+the TCP and TLS handshakes are done once per connection instead of once
+per request. The settings are read from the environment:
+
+  DCI_HTTP_POOL_SIZE         connections kept open per host (10)
+  DCI_HTTP_KEEPALIVE         reuse the connections between requests (true)
+  DCI_HTTP_CONNECT_TIMEOUT   timeout in seconds to connect (10)
+  DCI_HTTP_READ_TIMEOUT      timeout in seconds to get a response (600)
+
+The writes are rate limited by dci_ratelimit and the calls are retried by
+dci_retry.
+'''
+
+import hashlib
+import os
+import threading
+
+from dciclient.v1.api import context as dci_context
+from requests.adapters import HTTPAdapter
+
+try:
+    from ansible.module_utils.dci_env import env_bool, env_number
+    from ansible.module_utils.dci_ratelimit import RateLimiter
+    from ansible.module_utils.dci_retry import RetryPolicy
+except ImportError:
+    # controller side plugins
+    from module_utils.dci_env import env_bool, env_number
+    from module_utils.dci_ratelimit import RateLimiter
+    from module_utils.dci_retry import RetryPolicy
+
+_contexts = {}
+_contexts_lock = threading.Lock()
+
+
+def configure_session(session):
+    """Set up the connection pool, the timeouts and the retries of a
+    requests.Session."""
+    pool_size = env_number('DCI_HTTP_POOL_SIZE', 10)
+    # the retries are done by RetryPolicy, which knows when the non
+    # idempotent methods can be retried, instead of the urllib3 retries
+    # mounted by dciclient
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                          max_retries=0)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    if not env_bool('DCI_HTTP_KEEPALIVE', True):
+        session.headers['Connection'] = 'close'
+
+    timeout = (env_number('DCI_HTTP_CONNECT_TIMEOUT', 10, float),
+               env_number('DCI_HTTP_READ_TIMEOUT', 600, float))
+    request = session.request
+
+    def _request(method, url, *args, **kwargs):
+        kwargs['timeout'] = timeout
+        return request(method, url, *args, **kwargs)
+
+    session.request = _request
+    # installed below the retries so each attempt takes a token
+    limiter = RateLimiter.from_env()
+    if limiter is not None:
+        limiter.install(session)
+    RetryPolicy.from_env().install(session)
+    return session
+
+
+def build_context(url, login=None, password=None, client_id=None,
+                  api_secret=None, user_agent=None):
+    """Build a dciclient context from the credentials, None if they are
+    incomplete."""
+    if login and password:
+        context = dci_context.build_dci_context(url, login, password,
+                                                user_agent)
+    elif client_id and api_secret:
+        context = dci_context.build_signature_context(url, client_id,
+                                                      api_secret, user_agent)
+    else:
+        return None
+    configure_session(context.session)
+    return context
+
+
+def credentials_identity(url, login=None, password=None, client_id=None,
+                         api_secret=None):
+    """Identify a set of credentials by the URL, the login or client id and
+    a digest of the secret, so a changed secret gets a new identity without
+    keeping the secret."""
+    if login and password:
+        user, secret = login, password
+    else:
+        user, secret = client_id, api_secret
+    digest = hashlib.sha256((secret or '').encode('UTF-8')).hexdigest()
+    return ((url or '').rstrip('/'), user, digest)
+
+
+def get_context(url, login=None, password=None, client_id=None,
+                api_secret=None, user_agent=None):
+    """Return the context shared by the callers of this process using the
+    same credentials, building it on the first call.
+
+    The contexts are per process: a forked Ansible worker builds its own
+    instead of sharing the sockets of its parent."""
+    key = (os.getpid(),) + credentials_identity(url, login, password,
+                                                client_id, api_secret)
+    with _contexts_lock:
+        if key not in _contexts:
+            context = build_context(url, login, password, client_id,
+                                    api_secret, user_agent)
+            if context is None:
+                return None
+            _contexts[key] = context
+        return _contexts[key]
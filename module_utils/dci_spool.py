@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2026 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''
+Crash-safe on-disk spool for the records sent to the DCI control server.
+
+Records are appended to segment files, each record being a JSON header on
+one line followed by its payload. index.json holds the position of the
+first record not yet acknowledged. A leftover spool, or the archive
+written by the dci callback in offline mode, can be uploaded with:
+
+    python3 dci_spool.py [--job-id <job id>] [--workers N] <directory>
+'''
+
+import argparse
+import collections
+import fcntl
+import json
+import os
+import shutil
+import sys
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from requests.exceptions import ConnectionError
+
+SEGMENT_SIZE = 64 * 1024 * 1024
+
+
+class SpoolError(Exception):
+    def __init__(self, msg):
+        super(SpoolError, self).__init__(msg)
+        self.message = msg
+
+
+class Spool(object):
+    """A persistent FIFO of records with their payload."""
+
+    def __init__(self, directory, segment_size=SEGMENT_SIZE):
+        self.directory = directory
+        self.segment_size = segment_size
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._lockfile = open(os.path.join(directory, 'lock'), 'w')
+        try:
+            fcntl.flock(self._lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            self._lockfile.close()
+            raise SpoolError('spool %s is in use by another process' %
+                             directory)
+        self._index = self._read_index()
+        segments = self._segments()
+        self._segment = max(segments + [self._index[0]])
+        self._recover()
+
+    def _path(self, segment):
+        return os.path.join(self.directory, 'segment-%08d.log' % segment)
+
+    def _segments(self):
+        return sorted(int(f[8:16]) for f in os.listdir(self.directory)
+                      if f.startswith('segment-') and f.endswith('.log'))
+
+    def _read_index(self):
+        try:
+            with open(os.path.join(self.directory, 'index.json')) as f:
+                index = json.load(f)
+            return index['segment'], index['offset']
+        except (IOError, OSError, ValueError, KeyError):
+            segments = self._segments()
+            return (segments[0] if segments else 1), 0
+
+    def _write_index(self):
+        path = os.path.join(self.directory, 'index.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'segment': self._index[0], 'offset': self._index[1]},
+                      f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(path + '.tmp', path)
+
+    @staticmethod
+    def _read_record(f):
+        """Return the next (record, payload) of the file or None if there
+        is no complete record."""
+        header = f.readline()
+        if not header.endswith(b'\n'):
+            return None
+        try:
+            record = json.loads(header.decode('UTF-8'))
+        except ValueError:
+            return None
+        payload = f.read(record['size'])
+        if len(payload) < record['size']:
+            return None
+        return record, payload
+
+    def _recover(self):
+        """Drop the incomplete record written by an interrupted process at
+        the end of the last segment."""
+        path = self._path(self._segment)
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb+') as f:
+            end = 0
+            while self._read_record(f) is not None:
+                end = f.tell()
+            f.truncate(end)
+
+    def append(self, record, payload=b''):
+        """Append a record, payload being bytes or a file object."""
+        if hasattr(payload, 'read'):
+            payload.seek(0, os.SEEK_END)
+            size = payload.tell()
+            payload.seek(0)
+        else:
+            size = len(payload)
+        header = json.dumps(dict(record, size=size)).encode('UTF-8') + b'\n'
+        with self._lock:
+            path = self._path(self._segment)
+            if (os.path.exists(path) and
+                    os.path.getsize(path) >= self.segment_size):
+                self._segment += 1
+                path = self._path(self._segment)
+            with open(path, 'ab') as f:
+                f.write(header)
+                if hasattr(payload, 'read'):
+                    shutil.copyfileobj(payload, f)
+                else:
+                    f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def __iter__(self):
+        """Yield (position, record, payload) for the records not yet
+        acknowledged, oldest first."""
+        segment, offset = self._index
+        while segment <= self._segment:
+            path = self._path(segment)
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    f.seek(offset)
+                    entry = self._read_record(f)
+                    while entry is not None:
+                        yield (segment, f.tell()), entry[0], entry[1]
+                        entry = self._read_record(f)
+            segment += 1
+            offset = 0
+
+    def ack(self, position):
+        """Mark the records up to position as delivered."""
+        with self._lock:
+            self._index = position
+            self._write_index()
+            for segment in self._segments():
+                if segment < position[0]:
+                    os.unlink(self._path(segment))
+
+    def is_empty(self):
+        for _ in self:
+            return False
+        return True
+
+    def close(self):
+        self._lockfile.close()
+
+
+class JobstateMap(object):
+    """Ids of the jobstates created by a replay for the local jobstate ids
+    recorded in offline mode, saved in the spool to resume a replay."""
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, 'jobstates.json')
+        try:
+            with open(self.path) as f:
+                self.ids = json.load(f)
+        except (IOError, OSError, ValueError):
+            self.ids = {}
+
+    def get(self, local_id):
+        return self.ids.get(local_id, local_id)
+
+    def set(self, local_id, jobstate_id):
+        self.ids[local_id] = jobstate_id
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(self.ids, f)
+        os.rename(self.path + '.tmp', self.path)
+
+
+def _check_response(res, record):
+    if res.status_code // 100 != 2:
+        raise SpoolError('failed to upload %s: %s' %
+                         (record.get('name', 'jobstate'), res.text))
+
+
+def _ack_uploads(spool, pending, wait):
+    """Acknowledge the leading uploads of pending which are done, waiting
+    for the first one if wait is set. Return the number of records
+    acknowledged."""
+    count = 0
+    while pending and (wait or pending[0][2].done()):
+        wait = False
+        position, record, future = pending.popleft()
+        _check_response(future.result(), record)
+        spool.ack(position)
+        count += 1
+    return count
+
+
+def replay(spool, context, job_id=None, workers=1):
+    """Upload the records of a spool and return how many were uploaded.
+
+    Records captured before their job was known are attached to job_id.
+    The files between two jobstates are uploaded by workers threads; the
+    records are acknowledged in order so an interrupted replay can be
+    resumed, at the cost of uploading again the files in flight."""
+    from dciclient.v1.api import file as dci_file
+    from dciclient.v1.api import jobstate as dci_jobstate
+
+    jobstates = JobstateMap(spool.directory)
+    jobstate_id = None
+    count = 0
+    pending = collections.deque()
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        for position, record, payload in spool:
+            record_job_id = record.get('job_id') or job_id
+            if record_job_id is None:
+                raise SpoolError('no job id for %s, use --job-id' %
+                                 record.get('name', 'jobstate'))
+            if record['type'] == 'jobstate':
+                while pending:
+                    count += _ack_uploads(spool, pending, True)
+                res = dci_jobstate.create(context,
+                                          status=record['status'],
+                                          comment=record['comment'],
+                                          job_id=record_job_id)
+                _check_response(res, record)
+                jobstate_id = res.json()['jobstate']['id']
+                if record.get('id'):
+                    jobstates.set(record['id'], jobstate_id)
+                spool.ack(position)
+                count += 1
+                continue
+            future = executor.submit(
+                dci_file.create,
+                context,
+                name=record['name'],
+                content=payload,
+                mime=record['mime'],
+                job_id=record_job_id,
+                jobstate_id=jobstates.get(record.get('jobstate_id')) or
+                jobstate_id)
+            pending.append((position, record, future))
+            count += _ack_uploads(spool, pending, len(pending) >= 2 * workers)
+        while pending:
+            count += _ack_uploads(spool, pending, True)
+    finally:
+        executor.shutdown(wait=True)
+    return count
+
+
+def build_dci_context_from_env():
+    from module_utils.dci_session import build_context
+
+    context = build_context(os.getenv('DCI_CS_URL',
+                                      'https://api.distributed-ci.io'),
+                            os.getenv('DCI_LOGIN'),
+                            os.getenv('DCI_PASSWORD'),
+                            os.getenv('DCI_CLIENT_ID'),
+                            os.getenv('DCI_API_SECRET'))
+    if context is None:
+        raise SpoolError('Missing or incomplete credentials.')
+    return context
+
+
+def main(args=sys.argv[1:]):
+    parser = argparse.ArgumentParser(
+        description='Upload a leftover DCI spool to the control server')
+    parser.add_argument('--job-id',
+                        help='job of the records captured before the job '
+                        'was known')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='number of files uploaded in parallel')
+    parser.add_argument('directory', help='spool or offline archive '
+                        'directory')
+    options = parser.parse_args(args)
+
+    try:
+        spool = Spool(options.directory)
+        count = replay(spool, build_dci_context_from_env(), options.job_id,
+                       options.workers)
+    except (SpoolError, ConnectionError) as exc:
+        sys.stderr.write('%s\n' % exc)
+        return 1
+    print('%d records uploaded' % count)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.path.append(os.path.dirname(os.path.dirname(
+        os.path.realpath(__file__))))
+    sys.exit(main())
@@ -0,0 +1,173 @@
+import threading
+import time
+
+import pytest
+from requests.exceptions import ReadTimeout
+
+from module_utils.dci_base import DciBase, DciParameterError
+
+
+class Context(object):
+    dci_cs_api = 'http://localhost/api/v1'
+
+
+class Response(object):
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class FakeResource(object):
+    __name__ = 'dciclient.v1.api.team'
+
+    def __init__(self, names):
+        self.teams = [{'id': name, 'name': name, 'etag': 'e', 'country': None,
+                       'state': 'active'} for name in names]
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def list(self, context, where=None, limit=None, offset=0, sort=None):
+        with self.lock:
+            self.calls.append(('list', offset))
+        return Response(200, {'teams': self.teams[offset:offset + limit],
+                              '_meta': {'count': len(self.teams)}})
+
+    def create(self, context, name, country=None):
+        with self.lock:
+            self.calls.append(('create', name))
+        if name == 'conflict':
+            return Response(409, {'message': 'already exists'})
+        if name == 'timeout':
+            raise ReadTimeout('read timed out')
+        if name == 'bug':
+            raise TypeError('not a field error')
+        return Response(201)
+
+    def update(self, context, id, etag, **kwargs):
+        with self.lock:
+            self.calls.append(('update', id, sorted(kwargs.items())))
+        return Response(200)
+
+    def delete(self, context, id, etag):
+        with self.lock:
+            self.calls.append(('delete', id))
+        return Response(204)
+
+
+def test_list_all():
+    resource = FakeResource(['t%d' % i for i in range(5)])
+
+    teams = DciBase(resource).list_all(Context(), page_size=2)
+
+    assert [team['name'] for team in teams] == ['t0', 't1', 't2', 't3', 't4']
+    assert resource.calls == [('list', 0), ('list', 2), ('list', 4)]
+
+
+def test_reconcile():
+    resource = FakeResource(['same', 'updated', 'absent', 'extra'])
+    items = [{'name': 'same'},
+             {'name': 'updated', 'country': 'FR', 'active': False},
+             {'name': 'absent', 'state': 'absent'},
+             {'name': 'new', 'country': 'US'},
+             {'name': 'conflict'},
+             {'name': 'timeout'},
+             {'name': 'invalid', 'label': 'unknown field'}]
+
+    result = DciBase(resource).reconcile(Context(), items, purge=True,
+                                         purge_all=True, page_size=3)
+
+    assert result['created'] == ['new']
+    assert result['updated'] == ['updated']
+    assert sorted(result['deleted']) == ['absent', 'extra']
+    failed = [failure['name'] for failure in result['failed']]
+    # the unsupported fields are reported before any change
+    assert failed == ['invalid', 'conflict', 'timeout']
+    assert result['failed'][0]['msg'] == \
+        "got an unexpected keyword argument 'label'"
+    assert ('update', 'updated', [('country', 'FR'), ('name', 'updated'),
+                                  ('state', 'inactive')]) in resource.calls
+
+
+def test_reconcile_check_mode():
+    resource = FakeResource(['same', 'extra'])
+
+    result = DciBase(resource).reconcile(Context(), [{'name': 'same'},
+                                                     {'name': 'new'}],
+                                         purge=True, where='name:extra',
+                                         check_mode=True)
+
+    assert result == {'created': ['new'], 'updated': [], 'deleted': ['extra'],
+                      'failed': []}
+    assert resource.calls == [('list', 0)]
+
+
+def test_reconcile_type_error():
+    resource = FakeResource([])
+
+    with pytest.raises(TypeError):
+        DciBase(resource).reconcile(Context(), [{'name': 'bug'}])
+
+
+def test_reconcile_check_mode_unsupported():
+    resource = FakeResource([])
+
+    result = DciBase(resource).reconcile(Context(), [{'name': 'new'},
+                                                     {'name': 'invalid',
+                                                      'label': 'x'}],
+                                         check_mode=True)
+
+    assert result['created'] == ['new']
+    assert [failure['name'] for failure in result['failed']] == ['invalid']
+    assert resource.calls == [('list', 0)]
+
+
+def test_reconcile_purge_all():
+    resource = FakeResource(['same', 'extra'])
+
+    with pytest.raises(DciParameterError):
+        DciBase(resource).reconcile(Context(), [{'name': 'same'}], purge=True)
+
+    assert resource.calls == []
+
+
+def test_iter_list_prefetch():
+    resource = FakeResource(['t%d' % i for i in range(10)])
+
+    teams = DciBase(resource).iter_list(Context(), page_size=3, prefetch=2)
+
+    assert next(teams)['name'] == 't0'
+    # the next two pages are fetched while the first one is consumed
+    for _ in range(100):
+        if len(resource.calls) == 3:
+            break
+        time.sleep(0.01)
+    assert sorted(resource.calls) == [('list', 0), ('list', 3), ('list', 6)]
+    names = [team['name'] for team in teams]
+    assert names == ['t%d' % i for i in range(1, 10)]
+    assert sorted(resource.calls)[-1] == ('list', 9)
+
+
+def test_do_list_max_items():
+    resource = FakeResource(['t%d' % i for i in range(10)])
+    base = DciBase(resource)
+    base.search_criterias = {'where': None}
+    base.pagination = {'max_items': 4}
+
+    res = base.do_list(Context())
+
+    assert [team['name'] for team in res.json()['teams']] == ['t0', 't1',
+                                                              't2', 't3']
+    assert resource.calls == [('list', 0)]
+
+
+def test_pagination_params():
+    resource = FakeResource([])
+
+    assert DciBase(resource).pagination == {
+        'page_size': None, 'max_items': None, 'prefetch': None}
+    base = DciBase(resource, {'page_size': 10, 'prefetch': 2, 'name': 'x'})
+    assert base.pagination == {'page_size': 10, 'max_items': None,
+                               'prefetch': 2}
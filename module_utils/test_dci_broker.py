@@ -0,0 +1,121 @@
+import os
+import threading
+
+import pytest
+import requests
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from module_utils import dci_broker
+from module_utils.dci_session import build_context, credentials_identity
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    clients = []
+
+    def do_POST(self):
+        self.clients.append(self.client_address)
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        content = b'%s %s %s' % (self.path.encode(),
+                                 self.headers['Authorization'].encode(), body)
+        self.send_response(201)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def servers(tmpdir, monkeypatch):
+    http = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    Handler.clients = []
+    url = 'http://127.0.0.1:%d' % http.server_address[1]
+    broker = dci_broker.BrokerServer(
+        str(tmpdir.join('run', 'broker.sock')),
+        build_context(url, 'admin', 'admin'),
+        credentials_identity(url, 'admin', 'admin'))
+    monkeypatch.setenv('DCI_BROKER', 'true')
+    monkeypatch.setenv('DCI_BROKER_SOCKET', broker.path)
+    for server in (http, broker):
+        threading.Thread(target=server.serve_forever).start()
+    yield url, http, broker
+    for server in (http, broker):
+        server.shutdown()
+        server.server_close()
+
+
+def _session(url, login, password, identity=None):
+    """A new session per module run."""
+    context = build_context(url, login, password)
+    return dci_broker.attach(context.session, identity or
+                             credentials_identity(url, login, password))
+
+
+def test_broker_forward(servers):
+    url, _, broker = servers
+    assert os.stat(os.path.dirname(broker.path)).st_mode & 0o777 == 0o700
+    for idx in range(2):
+        # the credentials of the module are not sent to the broker
+        session = _session(url, 'admin', 'unknown',
+                           credentials_identity(url, 'admin', 'admin'))
+        res = session.post(url + '/api/v1/jobs', data=b'run %d' % idx)
+        assert res.status_code == 201
+        assert res.text == '/api/v1/jobs Basic YWRtaW46YWRtaW4= run %d' % idx
+    # both requests went through the connection kept by the broker
+    assert len(set(Handler.clients)) == 1
+
+
+def test_broker_other_credentials(servers):
+    url, _, _ = servers
+    session = _session(url, 'user', 'user')
+    res = session.post(url + '/api/v1/jobs', data=b'direct')
+    assert res.text == '/api/v1/jobs Basic dXNlcjp1c2Vy direct'
+
+    session = _session(url, 'admin', 'admin')
+    res = session.post(url + '/other', data=b'direct')
+    assert res.text == '/other Basic YWRtaW46YWRtaW4= direct'
+    assert len(set(Handler.clients)) == 2
+
+
+def test_broker_disabled(servers, monkeypatch, tmpdir):
+    url, _, broker = servers
+    monkeypatch.delenv('DCI_BROKER')
+    session = _session(url, 'admin', 'admin')
+    assert not isinstance(session.get_adapter(url), dci_broker.BrokerAdapter)
+
+    monkeypatch.setenv('DCI_BROKER', 'true')
+    monkeypatch.setenv('DCI_BROKER_SOCKET', str(tmpdir.join('missing')))
+    session = _session(url, 'admin', 'admin')
+    assert not isinstance(session.get_adapter(url), dci_broker.BrokerAdapter)
+
+    # the socket of another user could be in a shared directory
+    os.chmod(os.path.dirname(broker.path), 0o755)
+    monkeypatch.setenv('DCI_BROKER_SOCKET', broker.path)
+    session = _session(url, 'admin', 'admin')
+    assert not isinstance(session.get_adapter(url), dci_broker.BrokerAdapter)
+    with pytest.raises(dci_broker.BrokerError):
+        dci_broker.BrokerServer(broker.path, broker.context, broker.identity)
+
+
+def test_broker_not_running(servers):
+    url, _, broker = servers
+    session = _session(url, 'admin', 'admin')
+    assert isinstance(session.get_adapter(url), dci_broker.BrokerAdapter)
+    broker.shutdown()
+    broker.server_close()
+    # the broker stopped since: sent by the session itself
+    res = session.post(url + '/api/v1/jobs', data=b'direct')
+    assert res.text == '/api/v1/jobs Basic YWRtaW46YWRtaW4= direct'
+
+
+def test_broker_connection_error(servers, monkeypatch):
+    url, http, _ = servers
+    monkeypatch.setenv('DCI_RETRY_ATTEMPTS', '1')
+    session = _session(url, 'admin', 'admin')
+    http.shutdown()
+    http.server_close()
+    with pytest.raises(requests.exceptions.ConnectionError):
+        session.post(url + '/api/v1/jobs', data=b'')
@@ -0,0 +1,26 @@
+import gzip
+import io
+
+import pytest
+
+from module_utils.dci_compress import (compress, compressed_mime,
+                                       CompressionError)
+
+
+def test_compress_bytes():
+    assert gzip.decompress(compress(b'content', 'gzip')) == b'content'
+
+
+def test_compress_stream():
+    compressed = compress(io.BytesIO(b'content' * 1000), 'gzip')
+    assert gzip.decompress(compressed.read()) == b'content' * 1000
+
+
+def test_compressed_mime():
+    assert compressed_mime('application/junit', 'gzip') == \
+        'application/junit+gzip'
+
+
+def test_unknown_compression():
+    with pytest.raises(CompressionError):
+        compress(b'content', 'lzma')
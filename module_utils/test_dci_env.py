@@ -0,0 +1,19 @@
+from module_utils.dci_env import env_bool, env_number
+
+
+def test_env_number(monkeypatch):
+    monkeypatch.setenv('DCI_TEST_NUMBER', '2.5')
+    assert env_number('DCI_TEST_NUMBER', 1, float) == 2.5
+    assert env_number('DCI_TEST_NUMBER', 1) == 1
+    monkeypatch.delenv('DCI_TEST_NUMBER')
+    assert env_number('DCI_TEST_NUMBER', 3) == 3
+
+
+def test_env_bool(monkeypatch):
+    for value, expected in (('1', True), ('Yes', True), ('off', False),
+                            ('FALSE', False), ('maybe', None), ('', None)):
+        monkeypatch.setenv('DCI_TEST_BOOL', value)
+        assert env_bool('DCI_TEST_BOOL', None) is expected
+    monkeypatch.delenv('DCI_TEST_BOOL')
+    assert env_bool('DCI_TEST_BOOL') is False
+    assert env_bool('DCI_TEST_BOOL', True) is True
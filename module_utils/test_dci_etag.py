@@ -0,0 +1,121 @@
+from module_utils.dci_base import DciBase
+from module_utils.dci_etag import EtagCache
+
+
+class Context(object):
+    dci_cs_api = 'http://localhost/api/v1'
+
+
+class Response(object):
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class FakeResource(object):
+    __name__ = 'dciclient.v1.api.topic'
+
+    def __init__(self, etag):
+        self.etag = etag
+        self.calls = []
+
+    def get(self, context, id):
+        self.calls.append(('get', id))
+        return Response(200, {'topic': {'id': id, 'etag': self.etag}})
+
+    def update(self, context, id, etag, **kwargs):
+        self.calls.append(('update', etag))
+        if etag != self.etag:
+            return Response(412)
+        self.etag = etag + '+'
+        return Response(200, {'topic': dict(kwargs, id=id, etag=self.etag)})
+
+    def delete(self, context, id, etag):
+        self.calls.append(('delete', etag))
+        return Response(204 if etag == self.etag else 412)
+
+
+def test_etag_cache(tmpdir):
+    cache = EtagCache(str(tmpdir.join('etags')), size=2)
+    context = Context()
+
+    cache.remember(context, 'topic', {'topics': [{'id': 'a', 'etag': '1'},
+                                                 {'id': 'b', 'etag': '2'}]})
+    assert cache.get(context, 'topic', 'a') == '1'
+    cache.remember(context, 'topic', {'topic': {'id': 'a', 'etag': '3'}})
+    cache.remember(context, 'topic', {'topic': {'id': 'c', 'etag': '4'}})
+    # the least recently set etag is dropped
+    assert cache.get(context, 'topic', 'b') is None
+    assert cache.get(context, 'topic', 'a') == '3'
+    cache.discard(context, 'topic', 'a')
+    assert cache.get(context, 'topic', 'a') is None
+    assert cache.get(context, 'component', 'c') is None
+
+
+def test_update_with_cached_etag(tmpdir, monkeypatch):
+    monkeypatch.setenv('DCI_ETAG_CACHE', str(tmpdir.join('etags')))
+    context = Context()
+    resource = FakeResource('1')
+    base = DciBase(resource)
+    base.id = 'a'
+    base.deterministic_params = ['name']
+    base.name = 'new'
+
+    # unknown etag
+    res = base.do_update(context)
+    assert res.status_code == 200
+    assert resource.calls == [('get', 'a'), ('update', '1')]
+
+    EtagCache.from_env().remember(context, 'topic', res.json())
+    del resource.calls[:]
+    assert base.do_update(context).status_code == 200
+    assert resource.calls == [('update', '1+')]
+
+    # stale etag: fetched again
+    del resource.calls[:]
+    assert base.do_delete(context).status_code == 204
+    assert resource.calls == [('delete', '1+'), ('get', 'a'),
+                              ('delete', '1++')]
+    assert EtagCache.from_env().get(context, 'topic', 'a') is None
+
+
+def test_update_without_cache(monkeypatch):
+    monkeypatch.delenv('DCI_ETAG_CACHE', raising=False)
+    resource = FakeResource('1')
+    base = DciBase(resource)
+    base.id = 'a'
+
+    assert base.do_delete(Context()).status_code == 204
+    assert resource.calls == [('get', 'a'), ('delete', '1')]
+
+
+def test_cached_fields(tmpdir):
+    cache = EtagCache(str(tmpdir.join('etags')))
+    context = Context()
+
+    cache.remember(context, 'remoteci', {'remoteci': {
+        'id': 'a', 'name': 'lab', 'etag': '1', 'api_secret': 'secret'}})
+
+    assert cache.resource(context, 'remoteci', 'a') == {
+        'id': 'a', 'name': 'lab', 'etag': '1'}
+    assert 'secret' not in tmpdir.join('etags').read()
+    assert cache.resource(context, 'topic', 'a') is None
+
+
+def test_find_by_name(tmpdir):
+    cache = EtagCache(str(tmpdir.join('etags')))
+    context = Context()
+
+    cache.remember(context, 'topic', {'topics': [
+        {'id': 'a', 'name': 'RHEL-9', 'etag': '1', 'product_id': 'rhel'},
+        {'id': 'b', 'name': 'RHEL-9', 'etag': '2', 'product_id': 'other'}]})
+
+    assert cache.find(context, 'topic', 'RHEL-9',
+                      {'product_id': 'rhel'})['id'] == 'a'
+    assert cache.find(context, 'topic', 'RHEL-9', {})['id'] == 'b'
+    assert cache.find(context, 'topic', 'RHEL-9',
+                      {'product_id': 'unknown'}) is None
+    assert cache.find(context, 'team', 'RHEL-9', {}) is None
@@ -0,0 +1,90 @@
+import multiprocessing
+import time
+
+from module_utils.dci_ratelimit import RateLimiter
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, delay):
+        self.sleeps.append(delay)
+        self.now += delay
+
+
+def test_token_bucket(monkeypatch, tmpdir):
+    clock = Clock()
+    monkeypatch.setattr('time.time', clock.time)
+    monkeypatch.setattr('time.sleep', clock.sleep)
+    limiter = RateLimiter(2, burst=3, path=str(tmpdir.join('state')))
+
+    for _ in range(3):
+        limiter.acquire()
+    assert clock.sleeps == []
+    limiter.acquire()
+    assert clock.sleeps == [0.5]
+    clock.now += 10
+    for _ in range(3):
+        limiter.acquire()
+    assert clock.sleeps == [0.5]
+
+
+def test_shared_state(monkeypatch, tmpdir):
+    clock = Clock()
+    monkeypatch.setattr('time.time', clock.time)
+    monkeypatch.setattr('time.sleep', clock.sleep)
+    path = str(tmpdir.join('state'))
+
+    RateLimiter(1, burst=2, path=path).acquire()
+    RateLimiter(1, burst=2, path=path).acquire()
+    RateLimiter(1, burst=2, path=path).acquire()
+    assert clock.sleeps == [1.0]
+
+
+def _acquire(path, count):
+    limiter = RateLimiter(20, burst=1, path=path)
+    for _ in range(count):
+        limiter.acquire()
+
+
+def test_processes(tmpdir):
+    path = str(tmpdir.join('state'))
+    start = time.time()
+    processes = [multiprocessing.Process(target=_acquire, args=(path, 5))
+                 for _ in range(2)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    # 10 requests at 20 per second with a single token at start
+    assert time.time() - start >= 0.4
+
+
+def test_install_writes_only(monkeypatch):
+    acquired = []
+    monkeypatch.setattr(RateLimiter, 'acquire',
+                        lambda self: acquired.append(True))
+
+    class Session(object):
+        def request(self, method, url, *args, **kwargs):
+            return method
+
+    session = RateLimiter(1).install(Session())
+    session.request('GET', 'http://localhost/api/v1/jobs')
+    session.request('POST', 'http://localhost/api/v1/files')
+    assert acquired == [True]
+
+
+def test_from_env(monkeypatch, tmpdir):
+    monkeypatch.delenv('DCI_RATE_LIMIT', raising=False)
+    assert RateLimiter.from_env() is None
+    monkeypatch.setenv('DCI_RATE_LIMIT', '5')
+    monkeypatch.setenv('DCI_RATE_LIMIT_FILE', str(tmpdir.join('state')))
+    limiter = RateLimiter.from_env()
+    assert (limiter.rate, limiter.burst) == (5, 5)
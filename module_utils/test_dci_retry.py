@@ -0,0 +1,105 @@
+import pytest
+
+from requests.exceptions import ConnectionError, ConnectTimeout, ReadTimeout
+
+from module_utils.dci_retry import CircuitBreaker, CircuitOpenError, RetryPolicy
+
+
+class Response(object):
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+def sequence(*results):
+    results = list(results)
+
+    def call(*args, **kwargs):
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return Response(result)
+    return call
+
+
+def test_retry_transient_errors(monkeypatch):
+    monkeypatch.setattr('time.sleep', lambda delay: None)
+    policy = RetryPolicy(attempts=3)
+
+    res = policy.call(sequence(ConnectionError(), 503, 201))
+    assert res.status_code == 201
+    assert policy.retries == 2
+
+
+def test_no_retry_client_errors(monkeypatch):
+    monkeypatch.setattr('time.sleep', lambda delay: None)
+    policy = RetryPolicy(attempts=3)
+
+    assert policy.call(sequence(404, 201)).status_code == 404
+    assert policy.retries == 0
+
+
+def test_retry_exhausted(monkeypatch):
+    monkeypatch.setattr('time.sleep', lambda delay: None)
+    policy = RetryPolicy(attempts=2)
+
+    assert policy.call(sequence(500, 502)).status_code == 502
+    with pytest.raises(ConnectionError):
+        policy.call(sequence(ConnectionError(), ConnectionError()))
+
+
+def test_circuit_breaker(monkeypatch):
+    monkeypatch.setattr('time.sleep', lambda delay: None)
+    policy = RetryPolicy(attempts=1, breaker=CircuitBreaker(2, 60))
+    policy.call(sequence(500))
+    policy.call(sequence(500))
+
+    with pytest.raises(CircuitOpenError):
+        policy.call(sequence(201))
+
+    policy.breaker.opened_at -= 60
+    assert policy.call(sequence(201)).status_code == 201
+    assert policy.breaker.failures == 0
+
+
+def test_backoff_bounds():
+    policy = RetryPolicy(backoff=1.0, max_backoff=4.0)
+    for attempt in range(10):
+        assert 0 <= policy.delay(attempt) <= min(4.0, 2 ** attempt)
+
+
+def test_retry_rate_limited(monkeypatch):
+    monkeypatch.setattr('time.sleep', lambda delay: None)
+    policy = RetryPolicy(attempts=3)
+
+    assert policy.call(sequence(429, 201)).status_code == 201
+    assert policy.retries == 1
+
+
+def test_retry_not_idempotent(monkeypatch):
+    monkeypatch.setattr('time.sleep', lambda delay: None)
+    policy = RetryPolicy(attempts=3)
+
+    res = policy.call(sequence(ConnectTimeout(), 503, 201), idempotent=False)
+    assert res.status_code == 201
+    assert policy.retries == 2
+    # the control server may have processed the request
+    assert policy.call(sequence(502, 201),
+                       idempotent=False).status_code == 502
+    with pytest.raises(ReadTimeout):
+        policy.call(sequence(ReadTimeout(), 201), idempotent=False)
+    assert policy.retries == 2
+    assert policy.call(sequence(ReadTimeout(), 201)).status_code == 201
+
+
+def test_retry_deadline(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr('time.time', lambda: clock[0])
+
+    def read_timeout(*args, **kwargs):
+        clock[0] += 600
+        raise ReadTimeout()
+
+    policy = RetryPolicy(attempts=5, deadline=120)
+    with pytest.raises(ReadTimeout):
+        policy.call(read_timeout)
+    assert policy.retries == 0
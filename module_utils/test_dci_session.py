@@ -0,0 +1,53 @@
+from module_utils import dci_session
+
+
+def test_get_context_shared():
+    context = dci_session.get_context('http://localhost', 'admin', 'admin')
+
+    assert context is dci_session.get_context('http://localhost', 'admin',
+                                              'admin')
+    assert context is not dci_session.get_context('http://localhost',
+                                                  client_id='remoteci/id',
+                                                  api_secret='secret')
+    assert dci_session.get_context('http://localhost') is None
+
+
+def test_get_context_key():
+    context = dci_session.get_context('http://key', client_id='remoteci/id',
+                                      api_secret='secret')
+
+    assert context is dci_session.get_context('http://key/',
+                                              client_id='remoteci/id',
+                                              api_secret='secret')
+    assert context is not dci_session.get_context('http://key',
+                                                  client_id='remoteci/id',
+                                                  api_secret='rotated')
+
+
+def test_configure_session(monkeypatch):
+    monkeypatch.setenv('DCI_HTTP_POOL_SIZE', '4')
+    monkeypatch.setenv('DCI_HTTP_KEEPALIVE', 'false')
+    monkeypatch.setenv('DCI_HTTP_READ_TIMEOUT', '30')
+    calls = []
+
+    class Session(object):
+        headers = {}
+        adapters = {}
+
+        def mount(self, prefix, adapter):
+            self.adapters[prefix] = adapter
+
+        def request(self, method, url, **kwargs):
+            calls.append(kwargs)
+
+            class Response(object):
+                status_code = 200
+            return Response()
+
+    session = dci_session.configure_session(Session())
+    session.request('GET', 'http://localhost', timeout=600)
+
+    assert session.adapters['https://']._pool_maxsize == 4
+    assert session.adapters['https://'].max_retries.total == 0
+    assert session.headers['Connection'] == 'close'
+    assert calls == [{'timeout': (10.0, 30.0)}]
@@ -0,0 +1,126 @@
+import os
+
+from module_utils.dci_spool import Spool, SpoolError
+
+
+def test_spool_fifo(tmpdir):
+    spool = Spool(str(tmpdir))
+    spool.append({'name': 'first'}, b'content 1')
+    spool.append({'name': 'second'}, b'content 2')
+
+    records = list(spool)
+    assert [(r['name'], p) for _, r, p in records] == [('first', b'content 1'),
+                                                       ('second', b'content 2')]
+
+    spool.ack(records[0][0])
+    assert [r['name'] for _, r, _ in spool] == ['second']
+    spool.ack(records[1][0])
+    assert spool.is_empty()
+
+
+def test_spool_persistence(tmpdir):
+    spool = Spool(str(tmpdir))
+    spool.append({'name': 'first'})
+    spool.append({'name': 'second'})
+    spool.ack(next(iter(spool))[0])
+    spool.close()
+
+    spool = Spool(str(tmpdir))
+    assert [r['name'] for _, r, _ in spool] == ['second']
+
+
+def test_spool_truncated_record(tmpdir):
+    spool = Spool(str(tmpdir))
+    spool.append({'name': 'first'}, b'content')
+    spool.close()
+    with open(os.path.join(str(tmpdir), 'segment-00000001.log'), 'ab') as f:
+        f.write(b'{"name": "partial", "size": 100}\npartial')
+
+    spool = Spool(str(tmpdir))
+    spool.append({'name': 'second'}, b'content')
+    assert [r['name'] for _, r, _ in spool] == ['first', 'second']
+
+
+def test_spool_segments(tmpdir):
+    spool = Spool(str(tmpdir), segment_size=10)
+    for idx in range(3):
+        spool.append({'idx': idx}, b'0123456789')
+
+    assert len(os.listdir(str(tmpdir))) == 4
+    position = list(spool)[-1][0]
+    spool.ack(position)
+    assert spool.is_empty()
+    assert sorted(os.listdir(str(tmpdir))) == [
+        'index.json', 'lock', 'segment-00000003.log']
+
+
+def test_spool_locked(tmpdir):
+    spool = Spool(str(tmpdir))
+    try:
+        Spool(str(tmpdir))
+    except SpoolError:
+        pass
+    else:
+        assert False, 'SpoolError not raised'
+    spool.close()
+
+
+class Response(object):
+    def __init__(self, status_code, json=None):
+        self.status_code = status_code
+        self._json = json
+        self.text = ''
+
+    def json(self):
+        return self._json
+
+
+def test_replay_offline_archive(monkeypatch, tmpdir):
+    from dciclient.v1.api import file as dci_file
+    from dciclient.v1.api import jobstate as dci_jobstate
+    from module_utils.dci_spool import replay
+
+    files = []
+    monkeypatch.setattr(dci_jobstate, 'create', lambda context, **kwargs: Response(
+        201, {'jobstate': {'id': 'js-%s' % kwargs['status']}}))
+    monkeypatch.setattr(dci_file, 'create', lambda context, **kwargs: (
+        files.append((kwargs['name'], kwargs['job_id'],
+                      kwargs['jobstate_id'])) or Response(201)))
+
+    spool = Spool(str(tmpdir))
+    spool.append({'type': 'file', 'name': 'pre job', 'mime': 'text/plain',
+                  'job_id': None, 'jobstate_id': None})
+    spool.append({'type': 'jobstate', 'id': 'offline-1', 'status': 'new',
+                  'comment': '', 'job_id': 'job'})
+    for idx in range(10):
+        spool.append({'type': 'file', 'name': 'task %d' % idx,
+                      'mime': 'text/plain', 'job_id': 'job',
+                      'jobstate_id': 'offline-1'})
+
+    assert replay(spool, None, job_id='job', workers=4) == 12
+    assert files[0] == ('pre job', 'job', None)
+    assert sorted(files[1:]) == [('task %d' % idx, 'job', 'js-new')
+                                 for idx in range(10)]
+    assert spool.is_empty()
+
+
+def test_replay_failure(monkeypatch, tmpdir):
+    from dciclient.v1.api import file as dci_file
+    from module_utils.dci_spool import replay
+
+    monkeypatch.setattr(dci_file, 'create', lambda context, **kwargs: Response(
+        500 if kwargs['name'] == 'task 1' else 201))
+
+    spool = Spool(str(tmpdir))
+    for idx in range(3):
+        spool.append({'type': 'file', 'name': 'task %d' % idx,
+                      'mime': 'text/plain', 'job_id': 'job',
+                      'jobstate_id': None})
+
+    try:
+        replay(spool, None)
+    except SpoolError:
+        pass
+    else:
+        assert False, 'SpoolError not raised'
+    assert [r['name'] for _, r, _ in spool] == ['task 1', 'task 2']
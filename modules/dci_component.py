@@ -12,6 +12,7 @@
 
 from ansible.module_utils.basic import *
 from ansible.module_utils.dci_common import *
+from ansible.module_utils.dci_base import *
 
 import os
 
@@ -54,6 +55,7 @@ options:
   query:
     required: false
     description: query language
+extends_documentation_fragment: dci_list
 '''
 
 EXAMPLES = '''
@@ -135,6 +137,7 @@ def main():
         sort=dict(type='str'),
         query=dict(type='str')
     )
+    resource_argument_spec.update(list_argument_spec())
     resource_argument_spec.update(authentication_argument_spec())
 
     module = AnsibleModule(
@@ -263,8 +266,17 @@ def main():
             kwargs = {'where': clause[:-1]}
         if module.params["sort"]:
             kwargs["sort"] = module.params["sort"]
-        res = dci_topic.list_components(
-            ctx, module.params['topic_id'], **kwargs)
+
+        def list_components(context, **kwargs):
+            return dci_topic.list_components(
+                context, module.params['topic_id'], **kwargs)
+
+        components = DciBase(dci_component, module.params)
+        components.id = None
+        components.search_criterias = kwargs
+        res = run_action_func(
+            lambda context: components.do_list(context, list_components),
+            ctx, module)
 
     else:
         module.fail_json(msg='Unknown arguments')
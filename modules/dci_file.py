@@ -13,6 +13,10 @@
 from ansible.module_utils.basic import *
 from ansible.module_utils.dci_common import *
 from ansible.module_utils.dci_base import *
+from ansible.module_utils.dci_compress import (check_compression, compress,
+                                               compressed_mime,
+                                               CompressionError,
+                                               COMPRESSIONS)
 import os
 
 try:
@@ -62,6 +66,9 @@ options:
   content:
     required: false
     description: Contentn of the file to upload
+  compression:
+    required: false
+    description: Compress the file before uploading it (gzip or zstd), the compression being added as a suffix to the mime-type
   embed:
     required: false
     description:
@@ -69,6 +76,7 @@ options:
   query:
     required: false
     description: query language
+extends_documentation_fragment: dci_list
 '''
 
 EXAMPLES = '''
@@ -107,17 +115,36 @@ EXAMPLES = '''
     mime: 'application/junit'
   with_items:
     - '/tmp/result.xml'
+
+
+- name: Attach a compressed log to a job
+  dci_file:
+    job_id: '{{ job_id }}'
+    path: '/var/log/messages'
+    compression: gzip
 '''
 
 # TODO
 RETURN = '''
+file:
+  description:
+    - The file created, updated, deleted or retrieved. With
+      DCI_CACHED_RESULTS, only its id after an update answered with no
+      content, and only its id and name when it already exists and is in
+      the etag cache
+  returned: success
+  type: dict
+files:
+  description: The files listed
+  returned: when listing
+  type: list
 '''
 
 
 class DciFile(DciBase):
 
     def __init__(self, params):
-        super(DciFile, self).__init__(dci_file)
+        super(DciFile, self).__init__(dci_file, params)
         self.id = params.get('id')
         self.content = params.get('content')
         self.path = params.get('path')
@@ -126,6 +153,7 @@ class DciFile(DciBase):
         self.job_id = params.get('job_id')
         self.jobstate_id = params.get('jobstate_id')
         self.mime = params.get('mime')
+        self.compression = params.get('compression')
         self.search_criterias = {
             'embed': params.get('embed'),
             'where': params.get('where'),
@@ -152,6 +180,26 @@ class DciFile(DciBase):
         if self.path and not os.path.exists(self.path):
             raise DciParameterError('%s: No such file' % self.path)
 
+        if self.compression:
+            return self.do_create_compressed(context)
+
+        return super(DciFile, self).do_create(context)
+
+    def do_create_compressed(self, context):
+        try:
+            check_compression(self.compression)
+        except CompressionError as exc:
+            raise DciParameterError(exc.message)
+
+        if self.path:
+            with open(self.path, 'rb') as f:
+                self.content = compress(f, self.compression)
+            self.path = self.file_path = None
+        else:
+            self.content = compress(self.content.encode('UTF-8'),
+                                    self.compression)
+        self.mime = compressed_mime(self.mime, self.compression)
+
         return super(DciFile, self).do_create(context)
 
     def do_delete(self, context):
@@ -171,10 +219,12 @@ def main():
         job_id=dict(type='str'),
         jobstate_id=dict(type='str'),
         mime=dict(default='text/plain', type='str'),
+        compression=dict(choices=list(COMPRESSIONS), type='str'),
         embed=dict(type='str'),
         where=dict(type='str'),
         query=dict(type='str')
     )
+    resource_argument_spec.update(list_argument_spec())
     resource_argument_spec.update(authentication_argument_spec())
 
     module = AnsibleModule(
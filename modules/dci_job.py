@@ -14,10 +14,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from concurrent.futures import ThreadPoolExecutor
+
 from ansible.module_utils.basic import AnsibleModule
 from ansible.module_utils.dci_common import (authentication_argument_spec,
                                              build_dci_context,
                                              get_standard_action,
+                                             list_argument_spec,
                                              parse_http_response,
                                              run_action_func)
 from ansible.module_utils.dci_base import (
@@ -34,6 +37,9 @@ except ImportError:
 else:
     dciclient_found = True
 
+# components_by_query resolved in parallel
+COMPONENT_QUERY_WORKERS = 8
+
 
 DOCUMENTATION = '''
 ---
@@ -120,6 +126,7 @@ options:
   query:
     required: false
     description: query language
+extends_documentation_fragment: dci_list
 '''
 
 EXAMPLES = '''
@@ -170,6 +177,18 @@ EXAMPLES = '''
 
 # TODO
 RETURN = '''
+job:
+  description:
+    - The job created, updated, deleted or retrieved. With
+      DCI_CACHED_RESULTS, only its id after an update answered with no
+      content, and only its id and name when it already exists and is in
+      the etag cache
+  returned: success
+  type: dict
+jobs:
+  description: The jobs listed
+  returned: when listing
+  type: list
 '''
 
 
@@ -180,7 +199,7 @@ def _nonify(value):
 class DciJob(DciBase):
 
     def __init__(self, params):
-        super(DciJob, self).__init__(dci_job)
+        super(DciJob, self).__init__(dci_job, params)
         self.id = params.get('id')
         self.topic = params.get('topic')
         self.comment = params.get('comment')
@@ -190,8 +209,8 @@ class DciJob(DciBase):
         self.upgrade = params.get('upgrade')
         self.key = params.get('key', None)
         self.value = params.get('value', None)
-        self.components = params.get('components', [])
-        self.components_by_query = params.get('components_by_query', [])
+        self.components = params.get('components') or []
+        self.components_by_query = params.get('components_by_query') or []
         self.team_id = params.get('team_id')
         self.pipeline_id = params.get('pipeline_id')
         self.url = _nonify(params.get('url'))
@@ -287,40 +306,50 @@ class DciJob(DciBase):
             context, self.id,
             **self.search_criterias)
 
-    def find_components(self, context, topic_id):
-        components = []
-        for component in self.components_by_query:
-            components_res = dci_topic.list_components(context,
-                                                       topic_id,
-                                                       where=component)
-            try:
-                message = components_res.json()['message']
-            except Exception:
-                message = components_res.text
-
-            if components_res.status_code < 400:
-                if components_res.status_code == 200:
-                    _components = components_res.json()['components']
-                    if len(_components) == 0:
-                        raise DciError(
-                            '403|404',
-                            'Not found or not enough permissions '
-                            'on component %s (%s)' % (component, message,)
-                        )
-                    components.append(_components[0]['id'])
-            elif components_res.status_code in [401, 412]:
-                raise DciError(
-                    components.status_code,
-                    'Not enough permissions on component %s (%s)' %
-                    (component, message,)
-                )
-            else:
-                raise DciError(
-                    components_res.status_code,
-                    'Error while retrieving %s (%s)' % (component, message,)
-                )
+    def find_component(self, context, topic_id, query):
+        """Return the id of the first component of the topic matching
+        query."""
+        components_res = dci_topic.list_components(context,
+                                                   topic_id,
+                                                   where=query,
+                                                   limit=1)
+        try:
+            message = components_res.json()['message']
+        except Exception:
+            message = components_res.text
+
+        if components_res.status_code < 400:
+            if components_res.status_code == 200:
+                _components = components_res.json()['components']
+                if len(_components) == 0:
+                    raise DciError(
+                        '403|404',
+                        'Not found or not enough permissions '
+                        'on component %s (%s)' % (query, message,)
+                    )
+                return _components[0]['id']
+        elif components_res.status_code in [401, 412]:
+            raise DciError(
+                components_res.status_code,
+                'Not enough permissions on component %s (%s)' %
+                (query, message,)
+            )
+        else:
+            raise DciError(
+                components_res.status_code,
+                'Error while retrieving %s (%s)' % (query, message,)
+            )
 
-        return components
+    def find_components(self, context, topic_id):
+        """Resolve the queries of components_by_query concurrently, the
+        ids being returned in the order of the queries."""
+        workers = min(COMPONENT_QUERY_WORKERS, len(self.components_by_query))
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            ids = list(executor.map(
+                lambda query: self.find_component(context, topic_id, query),
+                self.components_by_query))
+        return [component_id for component_id in ids
+                if component_id is not None]
 
     def do_create(self, context):
         topic_res = dci_topic.list(context, where='name:' + self.topic)
@@ -404,6 +433,7 @@ def main():
         key=dict(type='str'),
         value=dict(type='float'),
     )
+    resource_argument_spec.update(list_argument_spec())
     resource_argument_spec.update(authentication_argument_spec())
 
     module = AnsibleModule(
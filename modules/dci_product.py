@@ -66,6 +66,7 @@ options:
   query:
     required: false
     description: query language
+extends_documentation_fragment: dci_list
 '''
 
 EXAMPLES = '''
@@ -100,13 +101,25 @@ EXAMPLES = '''
 
 # TODO
 RETURN = '''
+product:
+  description:
+    - The product created, updated, deleted or retrieved. With
+      DCI_CACHED_RESULTS, only its id after an update answered with no
+      content, and only its id and name when it already exists and is in
+      the etag cache
+  returned: success
+  type: dict
+products:
+  description: The products listed
+  returned: when listing
+  type: list
 '''
 
 
 class DciProduct(DciBase):
 
     def __init__(self, params):
-        super(DciProduct, self).__init__(dci_product)
+        super(DciProduct, self).__init__(dci_product, params)
         self.id = params.get('id')
         self.name = params.get('name')
         self.label = params.get('label')
@@ -149,6 +162,7 @@ def main():
         where=dict(type='str'),
         query=dict(type='str')
     )
+    resource_argument_spec.update(list_argument_spec())
     resource_argument_spec.update(authentication_argument_spec())
 
     module = AnsibleModule(
@@ -0,0 +1,201 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from ansible.module_utils.basic import *
+from ansible.module_utils.dci_common import *
+from ansible.module_utils.dci_base import *
+
+try:
+    from dciclient.v1.api import product as dci_product
+    from dciclient.v1.api import remoteci as dci_remoteci
+    from dciclient.v1.api import team as dci_team
+    from dciclient.v1.api import topic as dci_topic
+    from dciclient.v1.api import user as dci_user
+except ImportError:
+    dciclient_found = False
+else:
+    dciclient_found = True
+
+
+DOCUMENTATION = '''
+---
+module: dci_resources
+short_description: module to reconcile many resources of DCI at once
+description:
+  - DCI module making a list of resources of the same type match their
+    desired state. The current resources are listed with a few paged
+    calls, compared in memory and the needed creations, updates and
+    deletions are done in parallel.
+version_added: 2.9
+options:
+  dci_login:
+    required: false
+    description: User's DCI login
+  dci_password:
+    required: false
+    description: User's DCI password
+  dci_cs_url:
+    required: false
+    description: DCI Control Server URL
+  dci_client_id:
+    required: false
+    description: DCI Client ID
+  dci_api_secret:
+    required: false
+    description: DCI API secret
+  resource:
+    required: true
+    description: Type of the resources (team, product, topic, user or remoteci)
+  resources:
+    required: true
+    description:
+      - List of the desired resources, each one with the fields of the
+        resource, an optional active field and an optional state field
+        (present or absent)
+  key:
+    required: false
+    description: Field identifying a resource in the list (default name)
+  purge:
+    required: false
+    description: Delete the resources which are not in the list and match where (requires purge_all without where)
+  purge_all:
+    required: false
+    description: Confirm that purge without where deletes all the resources which are not in the list
+  where:
+    required: false
+    description: Criterias restricting the resources compared with the list
+  workers:
+    required: false
+    description: Number of changes applied in parallel (default 4)
+  page_size:
+    required: false
+    description: Number of resources listed per call (default 100)
+'''
+
+EXAMPLES = '''
+- name: Ensure the partner teams exist
+  dci_resources:
+    resource: team
+    resources:
+      - name: 'A-Team'
+        country: 'USA'
+      - name: 'B-Team'
+        has_pre_release_access: true
+      - name: 'C-Team'
+        state: absent
+
+
+- name: Ensure the remotecis of a team are exactly these ones
+  dci_resources:
+    resource: remoteci
+    where: 'team_id:XXXX'
+    purge: true
+    resources:
+      - name: 'lab-1'
+        team_id: XXXX
+      - name: 'lab-2'
+        team_id: XXXX
+        active: false
+'''
+
+RETURN = '''
+created:
+  description: Keys of the resources created
+  returned: success
+  type: list
+updated:
+  description: Keys of the resources updated
+  returned: success
+  type: list
+deleted:
+  description: Keys of the resources deleted
+  returned: success
+  type: list
+failed:
+  description: Keys and error messages of the changes which failed
+  returned: always
+  type: list
+'''
+
+
+class DciResources(DciBase):
+
+    def __init__(self, resource, params):
+        super(DciResources, self).__init__(resource)
+        self.id = None
+        self.resources = params.get('resources')
+        self.key = params.get('key')
+        self.purge = params.get('purge')
+        self.where = params.get('where')
+        self.purge_all = params.get('purge_all')
+        self.workers = params.get('workers')
+        self.page_size = params.get('page_size')
+        self.check_mode = params.get('check_mode')
+
+    def do_reconcile(self, context):
+        return self.reconcile(context, self.resources, key=self.key,
+                              purge=self.purge, where=self.where,
+                              purge_all=self.purge_all,
+                              workers=self.workers,
+                              page_size=self.page_size,
+                              check_mode=self.check_mode)
+
+
+def main():
+
+    resource_argument_spec = dict(
+        resource=dict(required=True, type='str',
+                      choices=['team', 'product', 'topic', 'user',
+                               'remoteci']),
+        resources=dict(required=True, type='list', elements='dict'),
+        key=dict(default='name', type='str'),
+        purge=dict(default=False, type='bool'),
+        where=dict(type='str'),
+        purge_all=dict(default=False, type='bool'),
+        workers=dict(default=4, type='int'),
+        page_size=dict(default=100, type='int'),
+    )
+    resource_argument_spec.update(authentication_argument_spec())
+
+    module = AnsibleModule(
+        argument_spec=resource_argument_spec,
+        supports_check_mode=True
+    )
+
+    if not dciclient_found:
+        module.fail_json(msg='The python dciclient module is required')
+
+    context = build_dci_context(module)
+
+    resource = {
+        'team': dci_team,
+        'product': dci_product,
+        'topic': dci_topic,
+        'user': dci_user,
+        'remoteci': dci_remoteci,
+    }[module.params['resource']]
+    resources = DciResources(resource,
+                             dict(module.params,
+                                  check_mode=module.check_mode))
+
+    result = run_action_func(resources.do_reconcile, context, module)
+    result['changed'] = bool(result['created'] or result['updated'] or
+                             result['deleted'])
+    if result['failed']:
+        module.fail_json(msg='%d changes failed' % len(result['failed']),
+                         **result)
+
+    module.exit_json(**result)
+
+
+if __name__ == '__main__':
+    main()
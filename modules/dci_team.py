@@ -67,6 +67,7 @@ options:
   query:
     required: false
     description: query language
+extends_documentation_fragment: dci_list
 '''
 
 EXAMPLES = '''
@@ -103,13 +104,25 @@ EXAMPLES = '''
 
 # TODO
 RETURN = '''
+team:
+  description:
+    - The team created, updated, deleted or retrieved. With
+      DCI_CACHED_RESULTS, only its id after an update answered with no
+      content, and only its id and name when it already exists and is in
+      the etag cache
+  returned: success
+  type: dict
+teams:
+  description: The teams listed
+  returned: when listing
+  type: list
 '''
 
 
 class DciTeam(DciBase):
 
     def __init__(self, params):
-        super(DciTeam, self).__init__(dci_team)
+        super(DciTeam, self).__init__(dci_team, params)
         self.id = params.get('id')
         self.name = params.get('name')
         self.country = params.get('country')
@@ -145,6 +158,7 @@ def main():
         where=dict(type='str'),
         query=dict(type='str')
     )
+    resource_argument_spec.update(list_argument_spec())
     resource_argument_spec.update(authentication_argument_spec())
 
     module = AnsibleModule(
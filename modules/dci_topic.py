@@ -79,6 +79,7 @@ options:
   query:
     required: false
     description: query language
+extends_documentation_fragment: dci_list
 '''
 
 EXAMPLES = '''
@@ -119,13 +120,25 @@ EXAMPLES = '''
 
 # TODO
 RETURN = '''
+topic:
+  description:
+    - The topic created, updated, deleted or retrieved. With
+      DCI_CACHED_RESULTS, only its id after an update answered with no
+      content, and only its id and name when it already exists and is in
+      the etag cache
+  returned: success
+  type: dict
+topics:
+  description: The topics listed
+  returned: when listing
+  type: list
 '''
 
 
 class DciTopic(DciBase):
 
     def __init__(self, params):
-        super(DciTopic, self).__init__(dci_topic)
+        super(DciTopic, self).__init__(dci_topic, params)
         self.id = params.get('id')
         self.name = params.get('name')
         self.data = params.get('data')
@@ -169,6 +182,7 @@ def main():
         where=dict(type='str'),
         query=dict(type='str')
     )
+    resource_argument_spec.update(list_argument_spec())
     resource_argument_spec.update(authentication_argument_spec())
 
     module = AnsibleModule(
@@ -186,8 +200,9 @@ def main():
         for key in ('name', 'id'):
             if module.params[key]:
                 clause += '%s:%s,' % (key, module.params[key])
-        kwargs = {'where': clause[:-1]}
-        response = dci_topic.list(context, **kwargs)
+        topic = DciTopic(module.params)
+        topic.search_criterias = {'where': clause[:-1]}
+        response = run_action_func(topic.do_list, context, module)
         if response.status_code != 200:
             error = response.json()
             if 'message' in error and 'payload' in error:
@@ -70,6 +70,7 @@ options:
   query:
     required: false
     description: query language
+extends_documentation_fragment: dci_list
 '''
 
 EXAMPLES = '''
@@ -100,13 +101,25 @@ EXAMPLES = '''
 
 # TODO
 RETURN = '''
+user:
+  description:
+    - The user created, updated, deleted or retrieved. With
+      DCI_CACHED_RESULTS, only its id after an update answered with no
+      content, and only its id and name when it already exists and is in
+      the etag cache
+  returned: success
+  type: dict
+users:
+  description: The users listed
+  returned: when listing
+  type: list
 '''
 
 
 class DciUser(DciBase):
 
     def __init__(self, params):
-        super(DciUser, self).__init__(dci_user)
+        super(DciUser, self).__init__(dci_user, params)
         self.id = params.get('id')
         self.name = params.get('name')
         self.fullname = params.get('fullname')
@@ -148,6 +161,7 @@ def main():
         where=dict(type='str'),
         query=dict(type='str')
     )
+    resource_argument_spec.update(list_argument_spec())
     resource_argument_spec.update(authentication_argument_spec())
 
     module = AnsibleModule(
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2026 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''
+Measure the overhead of the dci callback.
+
+A synthetic playbook of N tasks run on M local hosts, each task displaying
+an output of the given size, is run without and with the dci callback
+uploading to a local fake control server. The DCI_* variables of the
+environment (DCI_ASYNC_UPLOAD, DCI_UPLOAD_BATCH_SIZE...) are passed to the
+playbook to compare the settings of the callback:
+
+    ./bench_callback.py --tasks 50 --hosts 1,10 --output-size 1000,100000 \\
+        --latency 0.02 --failure-rate 0.01
+'''
+
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+BASEDIR = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.realpath(__file__))))
+sys.path.insert(0, os.path.join(BASEDIR, 'tests'))
+
+from fake_dci_server import FakeDCIServer  # noqa: E402
+
+
+def write_playbook(directory, tasks, hosts, output_size):
+    inventory = os.path.join(directory, 'inventory')
+    with open(inventory, 'w') as f:
+        f.write('[bench]\n')
+        for idx in range(hosts):
+            f.write('host%04d ansible_connection=local '
+                    'ansible_python_interpreter=%s\n' %
+                    (idx, sys.executable))
+    playbook = os.path.join(directory, 'playbook.yml')
+    with open(playbook, 'w') as f:
+        f.write('---\n- hosts: bench\n  gather_facts: false\n  tasks:\n')
+        for idx in range(tasks):
+            f.write('    - name: task %d\n'
+                    '      debug:\n'
+                    '        msg: "{{ \'x\' * %d }}"\n' % (idx, output_size))
+    return inventory, playbook
+
+
+def run_playbook(inventory, playbook, forks, env):
+    """Run the playbook and return its wall time and peak RSS in KiB."""
+    start = time.time()
+    with open(os.devnull, 'w') as devnull:
+        process = subprocess.Popen(
+            ['ansible-playbook', '-i', inventory, '-f', str(forks), playbook],
+            stdout=devnull, env=env)
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise RuntimeError('ansible-playbook failed: %d' % process.returncode)
+    return time.time() - start, rusage.ru_maxrss
+
+
+def bench(tasks, hosts, output_size, latency, failure_rate, forks):
+    directory = tempfile.mkdtemp(prefix='dci-bench-')
+    inventory, playbook = write_playbook(directory, tasks, hosts,
+                                         output_size)
+    env = dict(os.environ,
+               ANSIBLE_CALLBACK_PLUGINS=os.path.join(BASEDIR, 'callback'),
+               ANSIBLE_RETRY_FILES_ENABLED='false',
+               ANSIBLE_HOST_KEY_CHECKING='false')
+    env.pop('ANSIBLE_CALLBACKS_ENABLED', None)
+    baseline, baseline_rss = run_playbook(inventory, playbook, forks, env)
+
+    server = FakeDCIServer(latency=latency, failure_rate=failure_rate,
+                           keep_content=False).start()
+    try:
+        env.update(ANSIBLE_CALLBACKS_ENABLED='dci',
+                   DCI_CS_URL=server.url,
+                   DCI_LOGIN='admin',
+                   DCI_PASSWORD='admin',
+                   DCI_JOB_ID=str(uuid.uuid4()))
+        env.pop('DCI_JOBSTATE_ID', None)
+        wall, rss = run_playbook(inventory, playbook, forks, env)
+    finally:
+        server.stop()
+    stats = server.stats.to_dict()
+    return {
+        'tasks': tasks,
+        'hosts': hosts,
+        'output_size': output_size,
+        'baseline_time': baseline,
+        'time': wall,
+        'overhead': wall - baseline,
+        'throughput': stats['bytes_received'] / wall,
+        'baseline_rss': baseline_rss,
+        'rss': rss,
+        'server': stats,
+    }
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--tasks', type=_int_list, default=[50],
+                        help='comma separated numbers of tasks')
+    parser.add_argument('--hosts', type=_int_list, default=[1],
+                        help='comma separated numbers of hosts')
+    parser.add_argument('--output-size', type=_int_list, default=[1000],
+                        help='comma separated sizes of the task outputs')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to each API request')
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                        help='ratio of the API requests failed with a 503')
+    parser.add_argument('--forks', type=int, default=5)
+    parser.add_argument('--json', help='file where the results are written')
+    options = parser.parse_args()
+
+    results = []
+    print('%6s %6s %10s %9s %9s %9s %11s %9s %6s' % (
+        'tasks', 'hosts', 'output', 'baseline', 'dci', 'overhead',
+        'throughput', 'peak RSS', 'files'))
+    for tasks, hosts, size in itertools.product(options.tasks, options.hosts,
+                                                options.output_size):
+        result = bench(tasks, hosts, size, options.latency,
+                       options.failure_rate, options.forks)
+        results.append(result)
+        print('%6d %6d %10d %8.2fs %8.2fs %8.2fs %7.2fMB/s %7dMB %6d' % (
+            tasks, hosts, size, result['baseline_time'], result['time'],
+            result['overhead'], result['throughput'] / 1e6,
+            result['rss'] // 1024, result['server']['files']))
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,502 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2026 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''
+Local stand-in for the DCI control server API.
+
+The resources are kept in memory: creation with the 409 on duplicate
+names, get, list with the where and query filters, sort, limit and offset,
+update and delete with the etag checks, the sub resources (job components,
+topic components, component files...), the job scheduling and the files
+with their content. It is enough to run the modules, the git action plugin
+and the callbacks without a control server, see run_tests.sh --local.
+
+Every request can be delayed by a fixed latency and fail with a 503 at a
+given rate, to measure the behavior of the dci callback and the modules
+against a slow or flaky server:
+
+    ./fake_dci_server.py --port 5000 --latency 0.05 --failure-rate 0.01
+'''
+
+import argparse
+import datetime
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Stats(object):
+    """Counters of the requests served."""
+
+    def __init__(self):
+        self.requests = 0
+        self.failures = 0
+        self.bytes_received = 0
+        self.files = 0
+        self.jobstates = 0
+        self._lock = threading.Lock()
+
+    def add(self, **counters):
+        with self._lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def to_dict(self):
+        return {'requests': self.requests, 'failures': self.failures,
+                'bytes_received': self.bytes_received, 'files': self.files,
+                'jobstates': self.jobstates}
+
+
+# resources whose name is unique, creating a duplicate returns a 409
+UNIQUE_NAMES = ('teams', 'products', 'topics', 'users', 'remotecis',
+                'feeders')
+
+
+def _now():
+    return datetime.datetime.utcnow().isoformat()
+
+
+def _singular(resource):
+    return resource if resource == 'identity' else resource[:-1]
+
+
+def _split_args(text):
+    """Split the comma separated arguments of a query, not inside
+    parentheses."""
+    args, depth, current = [], 0, ''
+    for char in text:
+        if char == ',' and depth == 0:
+            args.append(current)
+            current = ''
+            continue
+        depth += {'(': 1, ')': -1}.get(char, 0)
+        current += char
+    args.append(current)
+    return args
+
+
+def _match_value(value, expected):
+    if isinstance(value, list):
+        return expected in value
+    return str(value if value is not None else 'null') == expected
+
+
+def match_query(obj, query):
+    """Evaluate a query of the DCI query language (eq, ne, like, ilike,
+    contains, not_contains, and, or, null) on obj."""
+    name, _, args = query.strip().partition('(')
+    args = _split_args(args[:-1])
+    if name == 'and':
+        return all(match_query(obj, arg) for arg in args)
+    if name == 'or':
+        return any(match_query(obj, arg) for arg in args)
+    value = obj.get(args[0])
+    if name == 'eq':
+        return _match_value(value, args[1])
+    if name == 'ne':
+        return not _match_value(value, args[1])
+    if name == 'null':
+        return value is None
+    if name in ('like', 'ilike'):
+        pattern = '^%s$' % re.escape(args[1]).replace('%', '.*')
+        flags = re.IGNORECASE if name == 'ilike' else 0
+        return re.match(pattern, str(value), flags) is not None
+    if name == 'contains':
+        return all(arg in (value or []) for arg in args[1:])
+    if name == 'not_contains':
+        return not any(arg in (value or []) for arg in args[1:])
+    raise ValueError('unknown operator %s' % name)
+
+
+def match_where(obj, where):
+    """Evaluate a where clause, comma separated key:value, on obj."""
+    for clause in where.split(','):
+        key, _, expected = clause.partition(':')
+        if not _match_value(obj.get(key), expected):
+            return False
+    return True
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    @property
+    def store(self):
+        return self.server.store
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            return b''.join(chunks)
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def _reply(self, status, body=None, raw=None):
+        if raw is None:
+            raw = json.dumps(body).encode('UTF-8') if body is not None else b''
+        self.send_response(status)
+        if status == 204:
+            self.end_headers()
+            return
+        self.send_header('Content-Type', 'application/json'
+                         if body is not None else 'application/octet-stream')
+        self.send_header('Content-Length', str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def _not_found(self):
+        self._reply(404, {'message': 'not found', 'payload': {}})
+
+    def _route(self):
+        """Return the path elements after /api/v1 and the query string
+        parameters."""
+        url = urllib.parse.urlsplit(self.path)
+        path = url.path.strip('/').split('/')
+        if path[:2] != ['api', 'v1'] or len(path) < 3:
+            return None, {}
+        params = dict(urllib.parse.parse_qsl(url.query))
+        return path[2:], params
+
+    def _begin(self):
+        """Read the body and apply the latency and the failure rate. Return
+        None when the request has been failed."""
+        body = self._read_body()
+        self.server.stats.add(requests=1, bytes_received=len(body))
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if random.random() < self.server.failure_rate:
+            self.server.stats.add(failures=1)
+            self._reply(503, {'message': 'injected failure', 'payload': {}})
+            return None
+        return body
+
+    def _json(self, body):
+        try:
+            return json.loads(body.decode('UTF-8') or '{}')
+        except ValueError:
+            return {}
+
+    def _new(self, resource, obj):
+        return self.server.create(resource, obj)
+
+    def _etag_mismatch(self, obj):
+        etag = self.headers.get('If-match')
+        if etag is not None and etag != obj['etag']:
+            self._reply(412, {'message': 'etag mismatch', 'payload': {}})
+            return True
+        return False
+
+    def _list(self, objs, params, key):
+        objs = list(objs)
+        if params.get('where'):
+            objs = [o for o in objs if match_where(o, params['where'])]
+        if params.get('query'):
+            objs = [o for o in objs if match_query(o, params['query'])]
+        sort = params.get('sort', 'created_at')
+        for field in reversed(sort.split(',')):
+            reverse = field.startswith('-')
+            field = field.lstrip('-')
+            # case insensitive like the collation of the control server
+            objs.sort(key=lambda o: str(o.get(field, '')).lower(),
+                      reverse=reverse)
+        count = len(objs)
+        offset = int(params.get('offset', 0))
+        if params.get('limit'):
+            objs = objs[offset:offset + int(params['limit'])]
+        else:
+            objs = objs[offset:]
+        self._reply(200, {key: [self._embed(key, o, params) for o in objs],
+                          '_meta': {'count': count}})
+
+    def _embed(self, resource, obj, params):
+        """Return a copy of obj with the resources listed in the embed
+        parameter: the sub resources for a plural name, the resource
+        referenced by <name>_id for a singular one."""
+        if not params.get('embed'):
+            return obj
+        obj = dict(obj)
+        for name in params['embed'].split(','):
+            if name.endswith('s'):
+                obj[name] = sorted(self._children(resource, obj, name),
+                                   key=lambda o: o.get('created_at', ''))
+            else:
+                obj[name] = self.store.get(name + 's', {}).get(
+                    obj.get(name + '_id'))
+        return obj
+
+    def _children(self, resource, parent, sub):
+        """Return the sub resources of parent: the objects referenced by
+        the list parent[sub] or the objects of sub pointing to parent."""
+        if isinstance(parent.get(sub), list):
+            objs = self.store.get(sub, {})
+            return [objs.get(i, i) if not isinstance(i, dict) else i
+                    for i in parent[sub]]
+        key = '%s_id' % _singular(resource)
+        return [o for o in self.store.get(sub, {}).values()
+                if o.get(key) == parent['id']]
+
+    def _create_file(self, body, **fields):
+        obj = self._new('files', dict(
+            name=self.headers.get('DCI-NAME'),
+            mime=self.headers.get('DCI-MIME'),
+            job_id=self.headers.get('DCI-JOB-ID'),
+            jobstate_id=self.headers.get('DCI-JOBSTATE-ID'),
+            md5=self.headers.get('DCI-MD5'),
+            size=len(body), **fields))
+        if self.server.keep_content:
+            self.server.contents[obj['id']] = body
+        self.server.stats.add(files=1)
+        return obj
+
+    def do_POST(self):
+        body = self._begin()
+        if body is None:
+            return
+        path, _ = self._route()
+        if path is None:
+            return self._not_found()
+        resource = path[0]
+        data = self._json(body)
+
+        if resource == 'files' and len(path) == 1:
+            return self._reply(201, {'file': self._create_file(body)})
+        if resource == 'jobs' and path[1:] == ['schedule']:
+            data.setdefault('components', [])
+            return self._reply(201, {'job': self._new('jobs', dict(
+                data, status='new', keys_values=[]))})
+        if resource == 'jobs' and path[1:] == ['upgrade']:
+            return self._reply(201, {'job': self._new('jobs', dict(
+                status='new', previous_job_id=data.get('job_id'),
+                components=[], keys_values=[]))})
+
+        if len(path) == 1:
+            if resource in UNIQUE_NAMES and data.get('name') is not None:
+                for obj in self.store.get(resource, {}).values():
+                    if obj.get('name') == data['name']:
+                        return self._reply(409, {
+                            'message': '%s already exists' % data['name'],
+                            'payload': {}})
+            if resource == 'jobstates':
+                self.server.stats.add(jobstates=1)
+                job = self.store.get('jobs', {}).get(data.get('job_id'))
+                if job is not None:
+                    job['status'] = data.get('status')
+            return self._reply(201, {_singular(resource):
+                                     self._new(resource, data)})
+
+        parent = self.store.get(resource, {}).get(path[1])
+        if parent is None:
+            return self._not_found()
+        sub = path[2] if len(path) > 2 else None
+        if resource == 'jobs' and sub == 'update':
+            return self._reply(201, {'job': self._new('jobs', dict(
+                status='new', update_previous_job_id=parent['id'],
+                topic_id=parent.get('topic_id'), components=[],
+                keys_values=[]))})
+        if sub == 'files':
+            return self._reply(201, {'component_file': self._create_file(
+                body, **{'%s_id' % _singular(resource): parent['id']})})
+        if sub == 'kv':
+            parent.setdefault('keys_values', []).append(data)
+            return self._reply(201, {'kv': data})
+        if sub is None:
+            return self._not_found()
+        # attach an existing resource: {"id": ...} or {"<resource>_id": ...}
+        ref = data.get('id') or data.get('%s_id' % _singular(sub))
+        parent.setdefault(sub, [])
+        if ref not in parent[sub]:
+            parent[sub].append(ref)
+        parent['etag'] = uuid.uuid4().hex
+        self._reply(201, {_singular(resource): parent})
+
+    def do_GET(self):
+        if self._begin() is None:
+            return
+        path, params = self._route()
+        if path is None:
+            return self._not_found()
+        resource = path[0]
+        if resource == 'identity':
+            return self._reply(200, {'identity': self.server.identity})
+        objs = self.store.get(resource, {})
+        if len(path) == 1:
+            return self._list(objs.values(), params, resource)
+        obj = objs.get(path[1])
+        if obj is None:
+            return self._not_found()
+        if len(path) == 2:
+            return self._reply(200, {_singular(resource):
+                                     self._embed(resource, obj, params)})
+        if path[2] == 'content':
+            content = self.server.contents.get(obj['id'])
+            if content is None:
+                return self._not_found()
+            return self._reply(200, raw=content)
+        if len(path) == 5 and path[4] == 'content':
+            content = self.server.contents.get(path[3])
+            if content is None:
+                return self._not_found()
+            return self._reply(200, raw=content)
+        if len(path) == 4:
+            child = self.store.get(path[2], {}).get(path[3])
+            if child is None:
+                return self._not_found()
+            return self._reply(200, {_singular(path[2]): child})
+        self._list(self._children(resource, obj, path[2]), params, path[2])
+
+    def do_PUT(self):
+        body = self._begin()
+        if body is None:
+            return
+        path, _ = self._route()
+        if path is None or len(path) != 2:
+            return self._not_found()
+        obj = self.store.get(path[0], {}).get(path[1])
+        if obj is None:
+            return self._not_found()
+        if self._etag_mismatch(obj):
+            return
+        obj.update(self._json(body))
+        obj['etag'] = uuid.uuid4().hex
+        obj['updated_at'] = _now()
+        self._reply(200, {_singular(path[0]): obj})
+
+    def do_DELETE(self):
+        if self._begin() is None:
+            return
+        path, _ = self._route()
+        if path is None or len(path) < 2:
+            return self._not_found()
+        objs = self.store.get(path[0], {})
+        obj = objs.get(path[1])
+        if obj is None:
+            return self._not_found()
+        if len(path) == 2:
+            if self._etag_mismatch(obj):
+                return
+            del objs[path[1]]
+            self.server.contents.pop(path[1], None)
+            return self._reply(204)
+        if len(path) == 4 and path[3] in obj.get(path[2], []):
+            obj[path[2]].remove(path[3])
+        elif len(path) == 4 and path[3] in self.store.get(path[2], {}):
+            del self.store[path[2]][path[3]]
+            self.server.contents.pop(path[3], None)
+        else:
+            return self._not_found()
+        self._reply(204)
+
+
+class FakeDCIServer(ThreadingHTTPServer):
+    """Fake DCI API listening on localhost, served by a background thread
+    between start() and stop()."""
+
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.0, failure_rate=0.0,
+                 verbose=False, keep_content=True):
+        ThreadingHTTPServer.__init__(self, ('127.0.0.1', port), Handler)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.verbose = verbose
+        self.keep_content = keep_content
+        self.stats = Stats()
+        self.store = {}
+        self.contents = {}
+        self.identity = {'id': str(uuid.uuid4()), 'name': 'admin',
+                         'teams': {}}
+        self._thread = None
+
+    def create(self, resource, obj):
+        """Store a new object with the fields set by the server."""
+        obj = dict({'state': 'active', 'tags': [], 'data': {}}, **obj)
+        obj.update({'id': str(uuid.uuid4()), 'etag': uuid.uuid4().hex,
+                    'created_at': _now(), 'updated_at': _now()})
+        if resource == 'components':
+            obj.setdefault('name', obj.get('display_name'))
+            obj.setdefault('display_name', obj['name'])
+            obj.setdefault('url', '')
+            obj.setdefault('version', '')
+        elif resource in ('remotecis', 'feeders'):
+            obj.setdefault('api_secret', uuid.uuid4().hex * 2)
+        self.store.setdefault(resource, {})[obj['id']] = obj
+        return obj
+
+    def seed(self):
+        """Create the resources provisioned in a dci-dev-env deployment
+        used by the functional tests."""
+        team = self.create('teams', {'name': 'admin'})
+        self.create('remotecis', {'name': 'openstack', 'team_id': team['id']})
+        self.identity['teams'] = {team['id']: {'team_name': 'admin'}}
+        return self
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to each request')
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                        help='ratio of the requests failed with a 503')
+    parser.add_argument('--no-content', action='store_true',
+                        help='do not keep the content of the files')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    options = parser.parse_args()
+
+    server = FakeDCIServer(options.port, options.latency,
+                           options.failure_rate, options.verbose,
+                           not options.no_content).seed()
+    print('Fake DCI control server listening on %s' % server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps(server.stats.to_dict()))
+
+
+if __name__ == '__main__':
+    main()
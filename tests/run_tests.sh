@@ -8,6 +8,13 @@ export DCI_LOGIN="${DCI_LOGIN:-admin}"
 export DCI_PASSWORD="${DCI_PASSWORD:-admin}"
 export DCI_CS_URL="${DCI_CS_URL:-http://localhost}"
 
+# --local: run against the fake control server of fake_dci_server.py
+LOCAL=0
+if [[ "${1:-}" == "--local" ]]; then
+    LOCAL=1
+    shift
+fi
+
 function create_venv(){
     rm -rf venv
     python3 -m venv venv
@@ -23,13 +30,28 @@ function activate_venv(){
     source venv/bin/activate
 }
 
+function start_fake_server(){
+    local port="${DCI_FAKE_SERVER_PORT:-5000}"
+    python3 fake_dci_server.py --port "$port" \
+        --latency "${DCI_FAKE_SERVER_LATENCY:-0}" > fake_dci_server.log 2>&1 &
+    FAKE_SERVER_PID=$!
+    trap 'kill $FAKE_SERVER_PID' EXIT
+    export DCI_CS_URL="http://127.0.0.1:$port"
+    for _ in $(seq 50); do
+        curl -sf "$DCI_CS_URL/api/v1/identity" > /dev/null && return
+        sleep 0.2
+    done
+    echo "The fake control server did not start, see fake_dci_server.log"
+    exit 1
+}
+
 function debug(){
     ansible --version
     ansible-playbook --version
 }
 
 function run_modules_tests() {
-    modules='dci_user dci_team dci_topic dci_component dci_feeder dci_product dci_job'
+    modules='dci_user dci_team dci_topic dci_component dci_feeder dci_product dci_job dci_resources'
 
     for module in $modules; do
         ansible-playbook modules/$module/playbook.yml -v
@@ -58,6 +80,10 @@ create_venv
 activate_venv
 debug
 
+if [[ $LOCAL == 1 ]]; then
+    start_fake_server
+fi
+
 if [[ ! -z ${1+x} ]]; then
     if [[ "$1" == "modules" ]]; then
         run_modules_tests
@@ -66,7 +92,7 @@ if [[ ! -z ${1+x} ]]; then
     elif [[ "$1" == "callbacks" ]]; then
         run_callbacks_tests
     else
-        echo "Usage: run_test.sh [modules|plugins|callbacks]"
+        echo "Usage: run_test.sh [--local] [modules|plugins|callbacks]"
     fi
 else
   run_modules_tests